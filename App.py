@@ -1,8 +1,16 @@
+import http.client
 import json
+import os
+import threading
+import urllib.parse
+import urllib.request
+import uuid
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
 import streamlit as st
+import analisi
+import versioni
 
 ### CONFIGURAZIONE PAGINA ###
 st.set_page_config(
@@ -42,97 +50,290 @@ st.markdown(
         * I filtri impattano su tutti i grafici.
         * I grafici sulla presenza di misure premiali e sulle quote femminili/giovanili mostreranno sempre i dati filtrati per queste caratteristiche.
         * In fondo alla pagina è possibile visualizzare il riepilogo dei filtri selezionati
-        * Possibilità di esportare il dataset in formato csv tramite la app.     
+        * Possibilità di esportare il dataset in formato csv (anche compresso gzip/zstd) o parquet tramite la app.     
     """
 )
 
 
 ### FUNZIONI UTILI###
-@st.cache_data
-def fetch_data(path:str)->pd.DataFrame:
+# API degli aggregati (api.py): se impostata, i conteggi dei grafici sono richiesti al servizio
+API_URL = os.environ.get("PNRR_API_URL")
+# secondi di attesa della risposta dell'API, oltre i quali i conteggi sono calcolati in locale
+API_TIMEOUT = float(os.environ.get("PNRR_API_TIMEOUT", 10))
+
+def calcola_aggregati(filtri:analisi.Filtri, nomi:tuple)->dict:
+    """
+        Aggregati indicati per i filtri impostati, calcolati in locale o richiesti all'API
+    """
+    if not API_URL:
+        return analisi.aggregati(analisi.PATH_DATI, filtri, nomi)
+    query = urllib.parse.urlencode(filtri.to_dict(), doseq=True)
+    endpoint = nomi[0] if len(nomi) == 1 else "aggregati"
+    try:
+        with urllib.request.urlopen(f"{API_URL}/api/{endpoint}?{query}", timeout=API_TIMEOUT) as risposta:
+            aggregati = analisi.aggregati_da_json(json.load(risposta))
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        # OSError comprende URLError/HTTPError, timeout e connessioni chiuse dal servizio,
+        # HTTPException le risposte troncate, ValueError le risposte non JSON; il dataset è comunque caricato dalla App
+        st.warning(f"API degli aggregati non disponibile ({e}): i conteggi sono calcolati in locale", icon="⚠️")
+        return analisi.aggregati(analisi.PATH_DATI, filtri, nomi)
+    return {nome: aggregati[nome] for nome in nomi}
+
+# voci e megabyte massimi di ciascuna cache dei risultati per filtri
+DIMENSIONE_CACHE = int(os.environ.get("PNRR_CACHE_RISULTATI", 64))
+MB_CACHE = float(os.environ.get("PNRR_CACHE_RISULTATI_MB", 256))
+
+@st.cache_resource
+def cache_risultati(nome:str)->analisi.CacheRisultati:
     """
-        Raccoglie il dato CIG
+        Cache dei risultati per combinazione di filtri, unica per processo e condivisa tra le sessioni:
+        "dati" per selezioni di righe, conteggi e mappa, "grafici" per i dati dei grafici
     """
-    data = pd.DataFrame(pd.read_parquet(path, engine="pyarrow"))
-    return data
+    return analisi.CacheRisultati(dimensione=DIMENSIONE_CACHE, byte_massimi=int(MB_CACHE * 2**20))
 
-@st.cache_data
-def fetch_geojson(path:str)->dict:
+@st.cache_resource
+def storico_misure()->analisi.StoricoMisure:
     """
-        Raccoglie e pre-processa il dato geografico per la mappatura 
+        Tempi delle fasi dei rerun di tutte le sessioni, per i percentili del pannello di debug
     """
-    with open(path, "r") as file:
-        geojson = json.load(file)
-    return geojson
+    return analisi.StoricoMisure()
 
-def convert_df(df):
-    return df.to_csv().encode('utf-8')
+def calcola_dati(filtri:analisi.Filtri, misure:analisi.Misure)->dict:
+    """
+        Selezioni di righe, conteggi e dati della mappa per i filtri dati,
+        calcolati una volta per combinazione di filtri e conservati nella cache dei risultati
+    """
+    dataset = analisi.fetch_data(analisi.PATH_DATI, **analisi.AMBITO)
+    # un'unica selezione di righe a partire dai bitmap precalcolati;
+    # in cache si conserva il bitmap compresso (un bit per riga), la maschera si ricava a ogni rerun
+    with misure.fase("filtri", righe_in=len(dataset)) as misura:
+        bitmap_data, _ = analisi.apply_filters(
+            index=analisi.build_filter_index(analisi.PATH_DATI),
+            filtri=filtri,
+            compressi=True
+        )
+        mask_data = analisi.maschera(bitmap_data, len(dataset))
+        n_righe = int(mask_data.sum())
+        misura["righe_out"] = n_righe
+    data = dataset[mask_data]
+    with misure.fase("riepilogo", righe_in=len(data)):
+        riepilogo = (data.CIG.nunique(), data.CUP.nunique(), data.COMUNE.nunique())
+    # i conteggi della mappa si ottengono dal cubo di aggregazione, con gli stessi filtri
+    with misure.fase("aggregati_mappa"):
+        cig_x_prov = calcola_aggregati(filtri, ("province",))["province"].copy()
+    cig_x_prov['PROVINCIA'] = cig_x_prov.index
+    cig_x_prov['PROVINCIA'] = cig_x_prov['PROVINCIA'].map(lambda x:str.title(x))
+
+    return {
+        "bitmap_data": bitmap_data,
+        "righe": n_righe,
+        "riepilogo": riepilogo,
+        "province": cig_x_prov
+    }
+
+def calcola_grafici(filtri:analisi.Filtri, misure:analisi.Misure)->dict:
+    """
+        Dati dei grafici di premialità per i filtri dei grafici (vedi Filtri.grafici),
+        conservati nella cache dei risultati. I grafici sono costruiti solo quando vengono visualizzati (vedi grafico)
+    """
+    with misure.fase("aggregati_grafici"):
+        aggregati = calcola_aggregati(filtri, ("regioni", "regioni_missioni", "missioni_componenti"))
+    # tutti gli indicatori di premialità in un solo passaggio per ciascuna coppia di dimensioni
+    with misure.fase("premialita"):
+        premialita = {
+            "regioni": aggregati["regioni"],
+            "regioni_missioni": analisi.premialita(aggregati["regioni_missioni"], ("REGIONE", "MISSIONE")),
+            "missioni_componenti": analisi.premialita(aggregati["missioni_componenti"], ("CODICE_MISSIONE", "COMPONENTE"))
+        }
+    return {"premialita": premialita, "grafici": {}}
+
+def grafico(risultati:dict, indicatore:str, vista:str, filtri:analisi.Filtri)->go.Figure:
+    """
+        Grafico di un indicatore di premialità: torta per regione ("torta"), barre per regione ("regioni")
+        o per missione ("missioni"). È costruito alla prima visualizzazione e conservato con i dati
+        dei grafici per i filtri dati (vedi Filtri.grafici), quindi riutilizzato dalle altre sessioni con gli stessi filtri
+    """
+    chiave = (indicatore, vista)
+    if chiave in risultati["grafici"]:
+        return risultati["grafici"][chiave]
+    premialita = risultati["premialita"]
+    scarto_regioni, scarto_missioni = next(scarti for nome, _, _, scarti in SEZIONI_PREMIALITA if nome == indicatore)
+    if vista == "torta":
+        counts = premialita["regioni"].loc[indicatore, ["CIG_FILTRATI"]].rename(columns={"CIG_FILTRATI": "CIG"})
+        counts = counts[counts["CIG"] > 0]
+        figura = px.pie(counts, 
+                        values="CIG", 
+                        names=counts.index, 
+                        color_discrete_sequence=px.colors.sequential.PuRd
+                        )
+    elif vista == "regioni":
+        recap, somme = premialita["regioni_missioni"]
+        figura = grafico_premialita(
+            recap.loc[indicatore], somme.loc[indicatore],
+            x="REGIONE", color="MISSIONE", scarto=scarto_regioni, hovertemplate=HOVER_REGIONI
+        )
+    else:
+        recap, somme = premialita["missioni_componenti"]
+        figura = grafico_premialita(
+            recap.loc[indicatore], somme.loc[indicatore],
+            x="CODICE_MISSIONE", color="COMPONENTE", scarto=scarto_missioni, hovertemplate=HOVER_MISSIONI
+        )
+    risultati["grafici"][chiave] = figura
+    # la voce della cache cresce con le figure: se ne aggiorna la memoria stimata
+    cache_risultati("grafici").aggiungi_byte(analisi.PATH_DATI, filtri, analisi.dimensione_byte(figura))
+    return figura
 
+@st.cache_resource
+def mappa_base(path:str, tolleranza:float)->dict:
+    """
+        Figura della mappa provinciale costruita una sola volta per livello di dettaglio:
+        a ogni rerun si aggiornano solo province e conteggi, sotto il lock della figura condivisa
+    """
+    figura = go.Figure(
+        go.Choropleth(
+            geojson=analisi.prepara_geojson(path, tolleranza),
+            featureidkey="properties.prov_name",
+            colorscale="PurD",
+            colorbar={"title": {"text": "CIG"}},
+            hovertemplate="PROVINCIA=%{location}<br>CIG=%{z}<extra></extra>"
+        )
+    )
+    figura.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
+    figura.update_geos(fitbounds="locations", visible=False)
+    figura.update_layout(geo=dict(bgcolor= 'rgba(0,0,0,0)'))
+    return {"figura": figura, "lock": threading.Lock()}
+
+# per ogni indicatore: titolo, titoli dei tab e scarto verticale delle annotazioni (regioni, missioni)
+SEZIONI_PREMIALITA = [
+    ("premiali", "**Bandi che prevedono quote premiali**",
+     ["Regioni e numero di bandi con premialità", "Componenti dei bandi con premialità"], (20, 40)),
+    ("femminile", "**Bandi che prevedono quote femminili > 30%**",
+     ["Regioni e bandi con quota femminile > 30%", "Componenti dei bandi con quota femminile > 30%"], (100, 150)),
+    ("giovanile", "**Bandi che prevedono quota giovanile > 30%**",
+     ["Regioni e bandi con quota giovanile > 30%", "Componenti dei bandi con quota giovanile > 30%"], (100, 200))
+]
+HOVER_REGIONI = (
+    'Missione: %{customdata[0]} <br>'+
+    'Numero di CIG (filtrati) per Missione nella Regione: %{y} <br>'+
+    'Percentuale rispetto al totale dei CIG per Missione nella Regione: %{customdata[1]}%'
+)
+HOVER_MISSIONI = (
+    'Componente: %{customdata[0]}<br>'+
+    'Numero di CIG filtrati per Componente nella Missione: %{y} <br>'+
+    'Percentuale rispetto al totale dei CIG per Componente nella Missione: %{customdata[1]}%'
+)
+
+def grafico_premialita(recap:pd.DataFrame, somme:pd.DataFrame, x:str, color:str, scarto:int, hovertemplate:str)->go.Figure:
+    """
+        Grafico a barre dei CIG filtrati, con il rapporto sul totale annotato sopra ogni barra
+    """
+    fig = px.bar(
+        recap.reset_index(), 
+        x=x, y="CIG_FILTRATI", 
+        color=color,
+        color_discrete_sequence=px.colors.sequential.PuRd,
+        hover_data=[color, "PRESENCE_ON_TOTAL_CIGS"]
+    )
+    # annotazioni aggiunte in blocco
+    fig.update_layout(
+        xaxis={'categoryorder':'total descending'}, 
+        showlegend=False,
+        annotations=[
+            dict(x=i, y=filtrati+scarto, text=f"{ratio:.2%}", showarrow=False, textangle=90)
+            for i, filtrati, ratio in zip(somme.index, somme["CIG_FILTRATI"], somme["RATIO"])
+        ]
+    )
+    fig.update_traces(hovertemplate=hovertemplate)
+    return fig
+
+
+### STRUMENTAZIONE ###
+# misure delle fasi del rerun, solo con PNRR_STRUMENTAZIONE=1
+misure = analisi.Misure()
+if "id_sessione" not in st.session_state:
+    st.session_state["id_sessione"] = uuid.uuid4().hex
 
 ### LOADING DATA ###
-# dati CIG-CUP
-st.session_state["data"] = fetch_data(path="data/cig_cup_final.parquet")
-st.session_state["data_charts"] = st.session_state["data"]
-# geo-data
-st.session_state["province"] = fetch_geojson(path="data/geojson_province_IT.json")
+# se il dataset è stato riscritto, risultati e dati caricati vengono invalidati prima della lettura
+cache_dati, cache_grafici = cache_risultati("dati"), cache_risultati("grafici")
+cache_dati.verifica(analisi.PATH_DATI)
+cache_grafici.verifica(analisi.PATH_DATI)
+# dati CIG-CUP, condivisi tra le sessioni: ogni sessione conserva solo le proprie selezioni di righe
+with misure.fase("caricamento") as misura:
+    dataset = analisi.fetch_data(analisi.PATH_DATI, **analisi.AMBITO)
+    misura["righe_out"] = len(dataset)
 
 ### SIDEBAR FILTRI ###
 st.sidebar.image("assets/period_logo.png", use_column_width=True)
 
-st.session_state["flag_premiali"] = st.sidebar.checkbox(
+# le selezioni restano in sospeso nel form fino alla conferma
+form_filtri = st.sidebar.form(key="form_filtri")
+
+st.session_state["flag_premiali"] = form_filtri.checkbox(
     label="Visualizzare solo quei bandi che prevedono **Misure Premiali**?"
 )
 
-st.session_state["flag_urgenza"] = st.sidebar.checkbox(
+st.session_state["flag_urgenza"] = form_filtri.checkbox(
     label="Visualizzare solo quei bandi la cui realizzazione è contrassegnata come **urgente**?"
 )
 
-st.session_state["filtro_quota_femminile"] = st.sidebar.radio(
+st.session_state["filtro_quota_femminile"] = form_filtri.radio(
     label="Filtra sulla **Quota Femminile** prevista dal bando",
     options=("Includi tutti", "Maggiore del 30%", "Inferiore al 30%")
 )
 
-st.session_state["filtro_quota_giovanile"] = st.sidebar.radio(
+st.session_state["filtro_quota_giovanile"] = form_filtri.radio(
     label="Filtra sulla **Quota Giovanile** prevista dal bando",
     options=("Includi tutti", "Maggiore del 30%", "Inferiore al 30%")
 )
-st.session_state["filtro_missioni"] = st.sidebar.multiselect(
+st.session_state["filtro_missioni"] = form_filtri.multiselect(
     label="Per quali **Missioni** vorresti monitorare i dati PNRR?",
-    options = st.session_state["data"].MISSIONE.sort_values().unique()
+    options = dataset.MISSIONE.sort_values().unique()
 )
 
-st.session_state["filtro_importo_finanziato"] = st.sidebar.multiselect(
+st.session_state["filtro_importo_finanziato"] = form_filtri.multiselect(
     label="Entità dell'**importo** del singolo CIG",
     options = ["BASSA", "MEDIA", "ALTA"],
     help="BASSA: minore di 100.000€, MEDIA è compresa tra 100.000€ e 1.000.000€, ALTA è oltre 1.000.000.000€"
 )
 
-st.session_state["filtro_regioni"] = st.sidebar.multiselect(
+st.session_state["filtro_regioni"] = form_filtri.multiselect(
     label="Per quali **Regioni** vorresti monitorare i dati PNRR?",
-    options = st.session_state["data"].REGIONE.dropna().sort_values().unique()
+    options = dataset.REGIONE.dropna().sort_values().unique()
 )
 
-st.session_state["filtro_province"] = st.sidebar.multiselect(
+st.session_state["filtro_province"] = form_filtri.multiselect(
     label="Per quali **Province** vorresti monitorare i dati PNRR?",
-    options = st.session_state["data"].PROVINCIA.dropna().sort_values().unique()
+    options = dataset.PROVINCIA.dropna().sort_values().unique()
 )
 
-st.session_state["filtro_comuni"] = st.sidebar.text_input(
+st.session_state["filtro_comuni"] = form_filtri.text_input(
     label="Puoi anche selezionare il nome del **Comune** di tuo interesse"
 )
+# se il nome non corrisponde a nessun Comune, suggerimenti dall'indice dei comuni (per prefisso o per somiglianza)
+if st.session_state["filtro_comuni"]:
+    indice_comuni = analisi.build_filter_index(analisi.PATH_DATI)["comuni"]
+    if analisi.trova_comune(indice_comuni, st.session_state["filtro_comuni"]) < 0:
+        suggerimenti = analisi.suggerisci_comuni(indice_comuni, st.session_state["filtro_comuni"])
+        form_filtri.caption(
+            "Comune non trovato" + (". Forse cercavi: " + ", ".join(suggerimenti) if suggerimenti else "")
+        )
 
-st.session_state["filtro_motivo_urgenza"] = st.sidebar.multiselect(
+st.session_state["filtro_motivo_urgenza"] = form_filtri.multiselect(
     label="Ti interessa monitorare un **motivo di urgenza** specifico?",
-    options = st.session_state["data"].MOTIVO_URGENZA.sort_values().unique(),
+    options = dataset.MOTIVO_URGENZA.sort_values().unique(),
     default=[]
 )
 
-st.session_state["filtro_esito"] = st.sidebar.multiselect(
+st.session_state["filtro_esito"] = form_filtri.multiselect(
     label="Ti interessa monitorare bandi con un **esito** specifico?",
-    options = st.session_state["data"].ESITO.sort_values().unique(),
+    options = dataset.ESITO.sort_values().unique(),
     default=[]
 )
 
+# i filtri sono applicati tutti insieme alla conferma, con un solo rerun
+form_filtri.form_submit_button(label="Applica i filtri")
+
 st.session_state["filters"] = {
                         "flag_premiali":st.session_state["flag_premiali"],
                         "flag_urgenza":st.session_state["flag_urgenza"],
@@ -152,323 +353,150 @@ if any(v=="None" for v in st.session_state["filters"].values()):
                 icon="⚠️")
 
 ### MANIPOLAZIONE DATI ### 
-if st.session_state["flag_premiali"]:
-    st.session_state["data"] = st.session_state["data"].query("FLAG_MISURE_PREMIALI=='S'")
-
-if st.session_state["flag_urgenza"]:
-    st.session_state["data"] = st.session_state["data"].query("FLAG_URGENZA==1")
-
-if st.session_state.filtro_quota_femminile != "Includi tutti":
-        if st.session_state.filtro_quota_femminile == "Maggiore del 30%":
-            st.session_state["data"] = st.session_state["data"][st.session_state["data"].QUOTA_FEMMINILE==">30%"]
-        elif st.session_state.filtro_quota_femminile == "Inferiore al 30%":
-             st.session_state["data"] = st.session_state["data"][st.session_state["data"].QUOTA_FEMMINILE!=">30%"]    
-
-if st.session_state.filtro_quota_giovanile != "Includi tutti":
-        if st.session_state.filtro_quota_giovanile == "Maggiore del 30%":
-            st.session_state["data"] = st.session_state["data"][st.session_state["data"].QUOTA_GIOVANILE==">30%"]
-        elif st.session_state.filtro_quota_giovanile == "Inferiore al 30%":
-             st.session_state["data"] = st.session_state["data"][st.session_state["data"].QUOTA_GIOVANILE!=">30%"]
-
-if st.session_state.filtro_regioni:
-    st.session_state["data"] = st.session_state["data"][st.session_state["data"].REGIONE.isin(st.session_state["filtro_regioni"])]
-
-if st.session_state.filtro_province:
-    st.session_state["data"] = st.session_state["data"][st.session_state["data"].PROVINCIA.isin(st.session_state["filtro_province"])]
-
-if st.session_state.filtro_comuni:
-     st.session_state["data"] = st.session_state["data"][st.session_state["data"].COMUNE == st.session_state["filtro_comuni"].upper()]
-
-if st.session_state.filtro_missioni:
-    st.session_state["data"] = st.session_state["data"][st.session_state["data"].MISSIONE.isin(st.session_state["filtro_missioni"])]
-
-if st.session_state.filtro_motivo_urgenza:
-    st.session_state["data"] = st.session_state["data"][st.session_state["data"].MOTIVO_URGENZA.isin(st.session_state["filtro_motivo_urgenza"])]
-
-if st.session_state.filtro_esito:
-    st.session_state["data"] = st.session_state["data"][st.session_state["data"].ESITO.isin(st.session_state["filtro_esito"])]
-
-if st.session_state.filtro_importo_finanziato:
-    st.session_state["data"] = st.session_state["data"][st.session_state["data"].CLASSE_IMPORTO.isin(st.session_state["filtro_importo_finanziato"])]
-
-
-## pie+bar charts##
-if st.session_state.filtro_regioni:
-    st.session_state["data_charts"] = st.session_state["data_charts"][st.session_state["data_charts"].REGIONE.isin(st.session_state["filtro_regioni"])]
-
-if st.session_state.filtro_province:
-    st.session_state["data_charts"] = st.session_state["data_charts"][st.session_state["data_charts"].PROVINCIA.isin(st.session_state["filtro_province"])]
-
-if st.session_state.filtro_comuni:
-     st.session_state["data_charts"] = st.session_state["data_charts"][st.session_state["data_charts"].COMUNE == st.session_state["filtro_comuni"].upper()]
-
-if st.session_state.filtro_missioni:
-    st.session_state["data_charts"] = st.session_state["data_charts"][st.session_state["data_charts"].MISSIONE.isin(st.session_state["filtro_missioni"])]
-
-if st.session_state.filtro_motivo_urgenza:
-    st.session_state["data_charts"] = st.session_state["data_charts"][st.session_state["data_charts"].MOTIVO_URGENZA.isin(st.session_state["filtro_motivo_urgenza"])]
-
-if st.session_state.filtro_esito:
-    st.session_state["data_charts"] = st.session_state["data_charts"][st.session_state["data_charts"].ESITO.isin(st.session_state["filtro_esito"])]
-
-if st.session_state.filtro_importo_finanziato:
-    st.session_state["data_charts"] = st.session_state["data_charts"][st.session_state["data_charts"].CLASSE_IMPORTO.isin(st.session_state["filtro_importo_finanziato"])]
+filtri = analisi.Filtri.da_dict(st.session_state["filters"])
+# le combinazioni di filtri già calcolate (anche da altre sessioni) si leggono dalla cache
+with misure.fase("risultati", righe_in=len(dataset)) as misura:
+    risultati = cache_dati.get(analisi.PATH_DATI, filtri, lambda filtri: calcola_dati(filtri, misure))
+    misura["righe_out"] = risultati["righe"]
+# i dati dei grafici non dipendono da misure premiali, urgenza e quote:
+# cambiando solo questi filtri si riusano quelli già calcolati
+with misure.fase("risultati_grafici"):
+    risultati_grafici = cache_grafici.get(analisi.PATH_DATI, filtri.grafici(), lambda filtri: calcola_grafici(filtri, misure))
+mask_data = analisi.maschera(risultati["bitmap_data"], len(dataset))
 
 ### FINE APPLICAZIONI FILTRI ###
 
 st.info(
-    f"Stai visualizzando un totale di {st.session_state.data.CIG.nunique()} CIG distribuiti su {st.session_state.data.CUP.nunique()} CUP e su {st.session_state.data.COMUNE.nunique()} Comuni", 
+    "Stai visualizzando un totale di {} CIG distribuiti su {} CUP e su {} Comuni".format(*risultati["riepilogo"]), 
     icon="ℹ️"
 )
 
 ### TABELLA FILTRATA ###
 with st.expander("Espandi per visualizzare i dati filtrati"):
-    st.dataframe(data=st.session_state["data"])
-    csv = convert_df(st.session_state["data"])
-    st.download_button(label="Clicca qui per scaricare i dati secondo i filtri impostati", 
-                       data=csv,
-                       file_name="period_analisi_pnrr.csv",
-                       mime="text/csv",
-                       use_container_width=True
-                       )
+    # al browser viene inviata solo la pagina visualizzata
+    n_righe = risultati["righe"]
+    colonne_tabella = st.multiselect(
+        label="Colonne da visualizzare",
+        options=list(dataset.columns),
+        default=list(dataset.columns)
+    )
+    col_pagina, col_righe, col_ordina, col_verso = st.columns(4)
+    righe_per_pagina = col_righe.selectbox(label="Righe per pagina", options=[25, 50, 100, 500])
+    n_pagine = max(1, -(-n_righe // righe_per_pagina))
+    pagina = col_pagina.number_input(label=f"Pagina (di {n_pagine})", min_value=1, max_value=n_pagine, value=1, step=1)
+    ordina_per = col_ordina.selectbox(label="Ordina per", options=["Nessun ordinamento"] + list(dataset.columns))
+    verso = col_verso.radio(label="Ordine", options=("Crescente", "Decrescente"))
+    with misure.fase("tabella", righe_in=n_righe) as misura:
+        tabella = analisi.pagina_dati(
+            dataset, mask_data, colonne_tabella, pagina, righe_per_pagina,
+            ordina_per=None if ordina_per == "Nessun ordinamento" else ordina_per,
+            crescente=verso == "Crescente"
+        )
+        misura["righe_out"] = len(tabella)
+        st.dataframe(data=tabella, use_container_width=True)
+    st.caption(f"Righe da {min(n_righe, (pagina - 1) * righe_per_pagina + 1)} a {min(n_righe, pagina * righe_per_pagina)} di {n_righe}")
+    memoria, memoria_object = analisi.memoria_dataset(analisi.PATH_DATI)
+    st.caption(f"Memoria del dataset: {memoria:.1f} MB (senza codifica a dizionario: {memoria_object:.1f} MB)")
+    for nome, cache in (("dati", cache_dati), ("grafici", cache_grafici)):
+        statistiche = cache.statistiche()
+        st.caption(f"Cache dei filtri ({nome}): {statistiche['hit']} hit, {statistiche['miss']} miss, {statistiche['voci']} voci su {statistiche['dimensione']}, {statistiche['byte'] / 2**20:.1f} MB su {statistiche['byte_massimi'] / 2**20:.0f}")
+    formato = st.selectbox(label="Formato del file da scaricare", options=list(analisi.FORMATI_EXPORT))
+    # il file viene serializzato solo quando viene richiesto
+    if st.button(label="Prepara il file con i dati secondo i filtri impostati", use_container_width=True):
+        estensione, mime, _ = analisi.FORMATI_EXPORT[formato]
+        # le righe filtrate si copiano solo per l'export
+        data = dataset[mask_data]
+        with misure.fase("export", righe_in=len(data)):
+            file_export = analisi.convert_df(data, formato=formato)
+        st.download_button(label="Clicca qui per scaricare i dati secondo i filtri impostati", 
+                           data=file_export,
+                           file_name=f"period_analisi_pnrr.{estensione}",
+                           mime=mime,
+                           use_container_width=True
+                           )
 
 ### MAPPA ###
-cig_x_prov = pd.DataFrame(st.session_state["data"][["CIG","PROVINCIA"]].groupby(['PROVINCIA'])['CIG'].nunique())
-cig_x_prov['PROVINCIA'] = cig_x_prov.index
-cig_x_prov['PROVINCIA'] = cig_x_prov['PROVINCIA'].map(lambda x:str.title(x))
+cig_x_prov = risultati["province"]
 
 with st.container():
     st.subheader("Numero di Bandi - Distribuzione Provinciale")
-    mappa_provinciale = px.choropleth(
-                                data_frame=cig_x_prov, 
-                                geojson=st.session_state["province"], 
-                                locations='PROVINCIA', 
-                                color='CIG', 
-                                featureidkey='properties.prov_name', 
-                                color_continuous_scale='PurD', 
-                                range_color=(0, max(cig_x_prov['CIG'])),
-                                labels={'COUNT':'Bandi PNRR per Provincia'}
-                                )
-    mappa_provinciale.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
-    mappa_provinciale.update_geos(fitbounds="locations", visible=False)
-    mappa_provinciale.update_layout(geo=dict(bgcolor= 'rgba(0,0,0,0)'))
-    st.plotly_chart(mappa_provinciale, use_container_width=True)
-
-### DIVISIONE REGIONI/MISSIONI ###
-full_count = pd.DataFrame(st.session_state.data_charts[["CIG","REGIONE","MISSIONE"]].groupby(["REGIONE", "MISSIONE"])["CIG"].nunique())
-full_count.columns = ["NUMERO_CIG"]
-full_count['PCT_CIG_MISSIONE_REGIONE'] = full_count['NUMERO_CIG'] / full_count.groupby('REGIONE')['NUMERO_CIG'].transform('sum') * 100
-full_count['PCT_CIG_MISSIONE_REGIONE'] = full_count['PCT_CIG_MISSIONE_REGIONE'].apply(lambda x: f'{x:.2f}%')
-
-### DIVISIONE MISSIONI/COMPONENTI ###
-full_count2 = pd.DataFrame(st.session_state.data_charts[["CIG","COMPONENTE","CODICE_MISSIONE"]].groupby(["CODICE_MISSIONE", "COMPONENTE"])["CIG"].nunique())
-full_count2.columns = ["NUMERO_CIG"]
-full_count2['PERCENTAGE_TOTAL_CIG'] = full_count2['NUMERO_CIG'] / full_count2.groupby('CODICE_MISSIONE')['NUMERO_CIG'].transform('sum') * 100
-full_count2['PERCENTAGE_TOTAL_CIG'] = full_count2['PERCENTAGE_TOTAL_CIG'].apply(lambda x: f'{x:.2f}%')
+    dettaglio = st.selectbox(label="Dettaglio della mappa", options=list(analisi.TOLLERANZE_MAPPA), index=1)
+    # geo-data: figura di base condivisa, si aggiornano solo i conteggi
+    with misure.fase("mappa", righe_in=len(cig_x_prov)):
+        mappa_provinciale = mappa_base(path=analisi.PATH_GEOJSON, tolleranza=analisi.TOLLERANZE_MAPPA[dettaglio])
+        with mappa_provinciale["lock"]:
+            mappa_provinciale["figura"].update_traces(
+                locations=cig_x_prov['PROVINCIA'],
+                z=cig_x_prov['CIG'],
+                zmin=0,
+                zmax=max(cig_x_prov['CIG'], default=0)
+            )
+            st.plotly_chart(mappa_provinciale["figura"], use_container_width=True)
 
 ### GRAFICI ###
-with st.container():
-    
-    st.write("**Bandi che prevedono quote premiali**")
-    temp_df = st.session_state["data_charts"].query("FLAG_MISURE_PREMIALI=='S'")[["CIG","REGIONE","MISSIONE"]]
-    counts = pd.DataFrame(temp_df[["CIG","REGIONE"]].groupby(['REGIONE'])['CIG'].nunique())
-    st.plotly_chart(
-        px.pie(counts, 
-                values="CIG", 
-                names=counts.index, 
-                color_discrete_sequence=px.colors.sequential.PuRd
-                ),
-        use_container_width=True
-    )
-    tab1, tab2 = st.tabs(["Regioni e numero di bandi con premialità", "Componenti dei bandi con premialità"])
-    with tab1:
-        regioni_filtered = pd.DataFrame(temp_df.groupby(["REGIONE", "MISSIONE"])["CIG"].nunique())
-        regioni_filtered.columns = ["CIG_FILTRATI"]
-        regioni_filtered['PCT_CIG_FILT_MISS_REG'] = regioni_filtered['CIG_FILTRATI'] / regioni_filtered.groupby('REGIONE')['CIG_FILTRATI'].transform('sum') * 100
-        regioni_filtered['PCT_CIG_FILT_MISS_REG'] = regioni_filtered['PCT_CIG_FILT_MISS_REG'].apply(lambda x: f'{x:.2f}%')
-        regioni_recap = pd.merge(full_count, regioni_filtered, left_index=True, right_index=True, how="outer")
-        regioni_recap["PRESENCE_ON_TOTAL_CIGS"] = round((regioni_recap["CIG_FILTRATI"] / regioni_recap["NUMERO_CIG"])*100)
-        regioni_sum = regioni_recap.groupby(['REGIONE'])['CIG_FILTRATI', 'NUMERO_CIG'].sum()
-        regioni_sum['RATIO'] = regioni_sum['CIG_FILTRATI'] / regioni_sum['NUMERO_CIG']
-        fig = px.bar(
-            regioni_recap.reset_index(), 
-            x="REGIONE", y="CIG_FILTRATI", 
-            color="MISSIONE",
-            color_discrete_sequence=px.colors.sequential.PuRd,
-            hover_data=["MISSIONE","PRESENCE_ON_TOTAL_CIGS"]
-        )
-        fig.update_layout(xaxis={'categoryorder':'total descending'}, showlegend=False)
-        for i, r in regioni_sum.iterrows():
-            fig.add_annotation(x=i, y=r['CIG_FILTRATI']+20, text=f"{r['RATIO']:.2%}", showarrow=False, textangle=90)
-        fig.update_traces(hovertemplate=
-                        'Missione: %{customdata[0]} <br>'+
-                        'Numero di CIG (filtrati) per Missione nella Regione: %{y} <br>'+
-                        'Percentuale rispetto al totale dei CIG per Missione nella Regione: %{customdata[1]}%'
-                        )
-        st.plotly_chart(fig)
-    with tab2: 
-        temp_df_a = st.session_state["data_charts"].query("FLAG_MISURE_PREMIALI=='S'")[["CIG","CODICE_MISSIONE", "COMPONENTE"]]
-        missioni_filtered = pd.DataFrame(temp_df_a.groupby(["CODICE_MISSIONE", "COMPONENTE"])["CIG"].nunique())
-        missioni_filtered.columns = ["CIG_FILTRATI"]
-        missioni_filtered['PERCENTAGE'] = missioni_filtered['CIG_FILTRATI'] / missioni_filtered.groupby('CODICE_MISSIONE')['CIG_FILTRATI'].transform('sum') * 100
-        missioni_filtered['PERCENTAGE'] = missioni_filtered['PERCENTAGE'].apply(lambda x: f'{x:.2f}%')
-        missioni_recap = pd.merge(full_count2, missioni_filtered, left_index=True, right_index=True, how="outer")
-        missioni_recap["PRESENCE_ON_TOTAL_CIGS"] = round((missioni_recap["CIG_FILTRATI"] / missioni_recap["NUMERO_CIG"])*100)
-        missioni_sum = missioni_recap.groupby(['CODICE_MISSIONE'])['CIG_FILTRATI', 'NUMERO_CIG'].sum()
-        missioni_sum['RATIO'] = missioni_sum['CIG_FILTRATI'] / missioni_sum['NUMERO_CIG']
-        fig_a = px.bar(
-            missioni_recap.reset_index(), 
-            x="CODICE_MISSIONE", 
-            y="CIG_FILTRATI", 
-            color="COMPONENTE",
-            color_discrete_sequence=px.colors.sequential.PuRd,
-            hover_data=["COMPONENTE", 'PRESENCE_ON_TOTAL_CIGS']
-        )
-        fig_a.update_layout(xaxis={'categoryorder':'total descending'}, showlegend=False)
-        for i, r in missioni_sum.iterrows():
-            fig_a.add_annotation(x=i, y=r['CIG_FILTRATI']+40, text=f"{r['RATIO']:.2%}", showarrow=False, textangle=90)
-        fig_a.update_traces(hovertemplate=
-                        'Componente: %{customdata[0]}<br>'+
-                        'Numero di CIG filtrati per Componente nella Missione: %{y} <br>'+
-                        'Percentuale rispetto al totale dei CIG per Componente nella Missione: %{customdata[1]}%'
-                        )
-        st.plotly_chart(fig_a)
-
-with st.container():
-    st.write("**Bandi che prevedono quote femminili > 30%**")
-    temp_df2 = st.session_state["data_charts"].query("QUOTA_FEMMINILE=='>30%'")[["CIG","REGIONE","MISSIONE"]]
-    counts2 = pd.DataFrame(temp_df2[["CIG","REGIONE"]].groupby(['REGIONE'])['CIG'].nunique())
-    st.plotly_chart(
-        px.pie(counts2, 
-                values="CIG", 
-                names=counts2.index, 
-                color_discrete_sequence=px.colors.sequential.PuRd
-                ),
-        use_container_width=True
-        )
-    tab3, tab4 = st.tabs(["Regioni e bandi con quota femminile > 30%", "Componenti dei bandi con quota femminile > 30%"])
-    with tab3:    
-        regioni_filtered2 = pd.DataFrame(temp_df2.groupby(["REGIONE", "MISSIONE"])["CIG"].nunique())
-        regioni_filtered2.columns = ["CIG_FILTRATI"]
-        regioni_filtered2['PCT_CIG_FILT_MISS_REG'] = regioni_filtered2['CIG_FILTRATI'] / regioni_filtered2.groupby('REGIONE')['CIG_FILTRATI'].transform('sum') * 100
-        regioni_filtered2['PCT_CIG_FILT_MISS_REG'] = regioni_filtered2['PCT_CIG_FILT_MISS_REG'].apply(lambda x: f'{x:.2f}%')
-        regioni_recap2 = pd.merge(full_count, regioni_filtered2, left_index=True, right_index=True, how="outer")
-        regioni_recap2["PRESENCE_ON_TOTAL_CIGS"] = round((regioni_recap2["CIG_FILTRATI"] / regioni_recap2["NUMERO_CIG"])*100)
-        regioni_sum2 = regioni_recap2.groupby(['REGIONE'])['CIG_FILTRATI', 'NUMERO_CIG'].sum()
-        regioni_sum2['RATIO'] = regioni_sum2['CIG_FILTRATI'] / regioni_sum2['NUMERO_CIG']
-        fig2 = px.bar(
-            regioni_recap2.reset_index(), 
-            x="REGIONE", y="CIG_FILTRATI", 
-            color="MISSIONE",
-            color_discrete_sequence=px.colors.sequential.PuRd,
-            hover_data=["MISSIONE", "PRESENCE_ON_TOTAL_CIGS"]
-        )
-        fig2.update_layout(xaxis={'categoryorder':'total descending'}, showlegend=False)
-        for i, r in regioni_sum2.iterrows():
-            fig2.add_annotation(x=i, y=r['CIG_FILTRATI']+100, text=f"{r['RATIO']:.2%}", showarrow=False, textangle=90)
-        fig2.update_traces(hovertemplate=
-                        'Missione: %{customdata[0]} <br>'+
-                        'Numero di CIG (filtrati) per Missione nella Regione: %{y} <br>'+
-                        'Percentuale rispetto al totale dei CIG per Missione nella Regione: %{customdata[1]}%'
-                        )
-        st.plotly_chart(fig2)
-    with tab4:
-        temp_df_b = st.session_state["data_charts"].query("QUOTA_FEMMINILE=='>30%'")[["CIG","CODICE_MISSIONE", "COMPONENTE"]]
-        missioni_filtered2 = pd.DataFrame(temp_df_b.groupby(["CODICE_MISSIONE", "COMPONENTE"])["CIG"].nunique())
-        missioni_filtered2.columns = ["CIG_FILTRATI"]
-        missioni_filtered2['PERCENTAGE'] = missioni_filtered2['CIG_FILTRATI'] / missioni_filtered2.groupby('CODICE_MISSIONE')['CIG_FILTRATI'].transform('sum') * 100
-        missioni_filtered2['PERCENTAGE'] = missioni_filtered2['PERCENTAGE'].apply(lambda x: f'{x:.2f}%')
-        missioni_recap2 = pd.merge(full_count2, missioni_filtered2, left_index=True, right_index=True, how="outer")
-        missioni_recap2["PRESENCE_ON_TOTAL_CIGS"] = round((missioni_recap2["CIG_FILTRATI"] / missioni_recap2["NUMERO_CIG"])*100)
-        missioni_sum2 = missioni_recap2.groupby(['CODICE_MISSIONE'])['CIG_FILTRATI', 'NUMERO_CIG'].sum()
-        missioni_sum2['RATIO'] = missioni_sum2['CIG_FILTRATI'] / missioni_sum2['NUMERO_CIG']
-        fig_b = px.bar(
-            missioni_recap2.reset_index(), 
-            x="CODICE_MISSIONE", 
-            y="CIG_FILTRATI", 
-            color="COMPONENTE",
-            color_discrete_sequence=px.colors.sequential.PuRd,
-            hover_data=["COMPONENTE", 'PRESENCE_ON_TOTAL_CIGS']
-        )
-        fig_b.update_layout(xaxis={'categoryorder':'total descending'}, showlegend=False)
-        for i, r in missioni_sum2.iterrows():
-            fig_b.add_annotation(x=i, y=r['CIG_FILTRATI']+150, text=f"{r['RATIO']:.2%}", showarrow=False, textangle=90)
-        fig_b.update_traces(hovertemplate=
-                        'Componente: %{customdata[0]}<br>'+
-                        'Numero di CIG filtrati per Componente nella Missione: %{y} <br>'+
-                        'Percentuale rispetto al totale dei CIG per Componente nella Missione: %{customdata[1]}%'
-                        )
-        st.plotly_chart(fig_b)
-
-with st.container():
-    st.write("**Bandi che prevedono quota giovanile > 30%**")
-    temp_df3 = st.session_state["data_charts"].query("QUOTA_GIOVANILE=='>30%'")[["CIG","REGIONE","MISSIONE"]]
-    counts3 = pd.DataFrame(temp_df3[["CIG","REGIONE"]].groupby(['REGIONE'])['CIG'].nunique())
-    st.plotly_chart(
-        px.pie(counts3, 
-                values="CIG", 
-                names=counts3.index, 
-                color_discrete_sequence=px.colors.sequential.PuRd
-                ),
-        use_container_width=True
-        )
-    tab5, tab6 = st.tabs(["Regioni e bandi con quota giovanile > 30%", "Componenti dei bandi con quota giovanile > 30%"])
-    with tab5:
-        regioni_filtered3 = pd.DataFrame(temp_df3.groupby(["REGIONE", "MISSIONE"])["CIG"].nunique())
-        regioni_filtered3.columns = ["CIG_FILTRATI"]
-        regioni_filtered3['PCT_CIG_FILT_MISS_REG'] = regioni_filtered3['CIG_FILTRATI'] / regioni_filtered3.groupby('REGIONE')['CIG_FILTRATI'].transform('sum') * 100
-        regioni_filtered3['PCT_CIG_FILT_MISS_REG'] = regioni_filtered3['PCT_CIG_FILT_MISS_REG'].apply(lambda x: f'{x:.2f}%')
-        regioni_recap3 = pd.merge(full_count, regioni_filtered3, left_index=True, right_index=True, how="outer")
-        regioni_recap3["PRESENCE_ON_TOTAL_CIGS"] = round((regioni_recap3["CIG_FILTRATI"] / regioni_recap3["NUMERO_CIG"])*100)
-        regioni_sum3 = regioni_recap3.groupby(['REGIONE'])['CIG_FILTRATI', 'NUMERO_CIG'].sum()
-        regioni_sum3['RATIO'] = regioni_sum3['CIG_FILTRATI'] / regioni_sum3['NUMERO_CIG']
-        fig3 = px.bar(
-            regioni_recap3.reset_index(), 
-            x="REGIONE", y="CIG_FILTRATI", 
-            color="MISSIONE",
-            color_discrete_sequence=px.colors.sequential.PuRd,
-            hover_data=["MISSIONE", "PRESENCE_ON_TOTAL_CIGS"]
+# viene costruita e inviata al browser solo la sezione selezionata
+sezioni = {indicatore: (titolo, titoli_tab) for indicatore, titolo, titoli_tab, _ in SEZIONI_PREMIALITA}
+indicatore = st.radio(
+    label="Indicatore di premialità",
+    options=list(sezioni),
+    format_func=lambda indicatore: sezioni[indicatore][0].strip("*"),
+    horizontal=True
+)
+titolo, titoli_tab = sezioni[indicatore]
+# nessun grafico se i filtri non selezionano alcun CIG
+if indicatore in risultati_grafici["premialita"]["regioni"].index.get_level_values("INDICATORE"):
+    with st.container(), misure.fase(f"grafici_{indicatore}"):
+        st.write(titolo)
+        st.plotly_chart(grafico(risultati_grafici, indicatore, "torta", filtri.grafici()), use_container_width=True)
+        vista = st.radio(
+            label="Dettaglio dell'indicatore",
+            options=["regioni", "missioni"],
+            format_func=dict(zip(["regioni", "missioni"], titoli_tab)).get,
+            horizontal=True,
+            label_visibility="collapsed"
         )
-        fig3.update_layout(xaxis={'categoryorder':'total descending'}, showlegend=False)
-        for i, r in regioni_sum3.iterrows():
-            fig3.add_annotation(x=i, y=r['CIG_FILTRATI']+100, text=f"{r['RATIO']:.2%}", showarrow=False, textangle=90)
-        fig3.update_traces(hovertemplate=
-                            'Missione: %{customdata[0]} <br>'+
-                            'Numero di CIG (filtrati) per Missione nella Regione: %{y} <br>'+
-                            'Percentuale rispetto al totale dei CIG per Missione nella Regione: %{customdata[1]}%'
-                        )
-        st.plotly_chart(fig3)
-    with tab6:
-        temp_df_c = st.session_state["data_charts"].query("QUOTA_GIOVANILE=='>30%'")[["CIG","CODICE_MISSIONE", "COMPONENTE"]]
-        missioni_filtered3 = pd.DataFrame(temp_df_c.groupby(["CODICE_MISSIONE", "COMPONENTE"])["CIG"].nunique())
-        missioni_filtered3.columns = ["CIG_FILTRATI"]
-        missioni_filtered3['PERCENTAGE'] = missioni_filtered3['CIG_FILTRATI'] / missioni_filtered3.groupby('CODICE_MISSIONE')['CIG_FILTRATI'].transform('sum') * 100
-        missioni_filtered3['PERCENTAGE'] = missioni_filtered3['PERCENTAGE'].apply(lambda x: f'{x:.2f}%')
-        missioni_recap3 = pd.merge(full_count2, missioni_filtered3, left_index=True, right_index=True, how="outer")
-        missioni_recap3["PRESENCE_ON_TOTAL_CIGS"] = round((missioni_recap3["CIG_FILTRATI"] / missioni_recap3["NUMERO_CIG"])*100)
-        missioni_sum3 = missioni_recap3.groupby(['CODICE_MISSIONE'])['CIG_FILTRATI', 'NUMERO_CIG'].sum()
-        missioni_sum3['RATIO'] = missioni_sum3['CIG_FILTRATI'] / missioni_sum3['NUMERO_CIG']
-        fig_c = px.bar(
-            missioni_recap3.reset_index(), 
-            x="CODICE_MISSIONE", 
-            y="CIG_FILTRATI", 
-            color="COMPONENTE",
-            color_discrete_sequence=px.colors.sequential.PuRd,
-            hover_data=["COMPONENTE", 'PRESENCE_ON_TOTAL_CIGS']
+        st.plotly_chart(grafico(risultati_grafici, indicatore, vista, filtri.grafici()))
+
+
+### ANDAMENTO TRA LE VERSIONI ###
+# dai riepiloghi delle versioni mensili archiviate (versioni.py), se ce ne sono almeno due
+elenco_versioni = versioni.elenco_versioni()
+if len(elenco_versioni) >= 2:
+    with st.container(), misure.fase("andamento"):
+        st.subheader("Andamento tra le versioni dei dati")
+        st.caption(f"{sezioni[indicatore][0]}: percentuale sul totale dei CIG in ogni versione dei dati, senza i filtri della sidebar")
+        livello = st.selectbox(label="Livello di dettaglio", options=["TOTALE", "REGIONE", "MISSIONE", "COMPONENTE"])
+        st.plotly_chart(
+            px.line(
+                versioni.andamento(indicatore, livello),
+                markers=True,
+                labels={"value": "% dei CIG", "VERSIONE": "Versione", "variable": livello.title()},
+                color_discrete_sequence=px.colors.sequential.PuRd[::-1]
+            ),
+            use_container_width=True
         )
-        fig_c.update_layout(xaxis={'categoryorder':'total descending'}, showlegend=False)
-        for i, r in missioni_sum3.iterrows():
-            fig_c.add_annotation(x=i, y=r['CIG_FILTRATI']+200, text=f"{r['RATIO']:.2%}", showarrow=False, textangle=90)
-        fig_c.update_traces(hovertemplate=
-                        'Componente: %{customdata[0]}<br>'+
-                        'Numero di CIG filtrati per Componente nella Missione: %{y} <br>'+
-                        'Percentuale rispetto al totale dei CIG per Componente nella Missione: %{customdata[1]}%'
-                        )
-        st.plotly_chart(fig_c)
+        with st.expander("Espandi per confrontare due versioni"):
+            da, a = st.select_slider(
+                label="Versioni da confrontare",
+                options=elenco_versioni,
+                value=(elenco_versioni[-2], elenco_versioni[-1])
+            )
+            st.dataframe(data=versioni.diff_versioni(da, a, livello), use_container_width=True)
 
 
 ### RECAP FILTRI IMPOSTATI ###
 with st.expander("Espandi per visualizzare un riassunto dei filtri selezionati"):
     filter_df = pd.DataFrame.from_dict(st.session_state["filters"], orient="index", columns=["Value"])
     st.dataframe(data=filter_df, use_container_width=True)
-            
\ No newline at end of file
+
+### DEBUG ###
+# visibile solo con la strumentazione attiva
+misure.chiudi()
+if misure.attiva:
+    storico = storico_misure()
+    storico.aggiungi(misure)
+    misure.log(sessione=st.session_state["id_sessione"], filtri=filtri.to_dict())
+    with st.expander("Debug: tempi e memoria delle fasi del rerun"):
+        st.dataframe(data=pd.DataFrame(misure.fasi).set_index("fase"), use_container_width=True)
+        st.caption("Percentili dei tempi per fase, sui rerun di tutte le sessioni")
+        st.dataframe(data=storico.percentili(), use_container_width=True)
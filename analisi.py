@@ -0,0 +1,805 @@
+"""
+    Funzioni di analisi della App, indipendenti da Streamlit: caricamento del dataset CIG-CUP,
+    indice dei filtri, cubo di aggregazione dei CIG distinti, geometrie della mappa ed export.
+    Sono usate dalla App (App.py) e dall'API HTTP/JSON (api.py).
+"""
+import difflib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, fields, replace
+from functools import lru_cache
+import unicodedata
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# dataset letto dalla App e dall'API (es. PNRR_DATI=data/partizionato per la copia scritta da etl.py --partizionato)
+PATH_DATI = os.environ.get("PNRR_DATI", "data/cig_cup_final.parquet")
+PATH_GEOJSON = "data/geojson_province_IT.json"
+
+# colonne a bassa cardinalità, caricate come categoriche (dizionari Arrow)
+COLONNE_CATEGORICHE = [
+    "REGIONE", "PROVINCIA", "COMUNE", "MISSIONE", "CODICE_MISSIONE", "COMPONENTE", "ESITO",
+    "MOTIVO_URGENZA", "CLASSE_IMPORTO", "QUOTA_FEMMINILE", "QUOTA_GIOVANILE", "FLAG_MISURE_PREMIALI"
+]
+# codici identificativi, caricati come id interi su dizionario
+COLONNE_CODICI = ["CIG", "CUP"]
+
+# ambito dell'istanza: regioni, missioni e classi di importo da caricare, separate da ";"
+# (es. PNRR_REGIONI="LAZIO" per una dashboard regionale); se non impostate si carica tutto
+AMBITO = {
+    filtro: tuple(valore for valore in os.environ.get(variabile, "").split(";") if valore) or None
+    for filtro, variabile in (("regioni", "PNRR_REGIONI"), ("missioni", "PNRR_MISSIONI"), ("importo", "PNRR_IMPORTO"))
+}
+
+@lru_cache(maxsize=None)
+def fetch_data(path:str, compatto:bool=True, regioni:tuple=None, missioni:tuple=None,
+               importo:tuple=None, colonne:tuple=None)->pd.DataFrame:
+    """
+        Raccoglie il dato CIG da un file parquet o da una cartella partizionata (anche hive, es. REGIONE=LAZIO).
+        I filtri su regioni, missioni e classi di importo sono applicati in lettura da pyarrow.dataset:
+        partizioni e row group esclusi dalle statistiche non vengono letti, così come le colonne non richieste.
+        In modalità compatta le colonne a bassa cardinalità e i codici CIG/CUP sono letti come dizionari
+        (categoriche pandas).
+        Il DataFrame è unico per processo e condiviso tra le sessioni: va trattato in sola lettura
+    """
+    dizionari = COLONNE_CATEGORICHE + COLONNE_CODICI if compatto else []
+    dati = ds.dataset(
+        path,
+        format=ds.ParquetFileFormat(read_options={"dictionary_columns": dizionari}),
+        # le colonne di partizione sono lette come testo e codificate dopo la lettura:
+        # con infer_dictionary pyarrow non unisce i dizionari se una partizione è nulla (__HIVE_DEFAULT_PARTITION__)
+        partitioning=ds.HivePartitioning.discover()
+    )
+    filtro = None
+    for col, valori in (("REGIONE", regioni), ("MISSIONE", missioni), ("CLASSE_IMPORTO", importo)):
+        if valori:
+            condizione = ds.field(col).isin(list(valori))
+            filtro = condizione if filtro is None else filtro & condizione
+    tabella = dati.to_table(columns=list(colonne) if colonne else None, filter=filtro)
+    for col in dizionari:
+        if col in tabella.column_names and not pa.types.is_dictionary(tabella.schema.field(col).type):
+            tabella = tabella.set_column(tabella.schema.get_field_index(col), col, tabella.column(col).dictionary_encode())
+    data = tabella.to_pandas()
+    for col in data.select_dtypes("category").columns:
+        # le categorie in ordine alfabetico mantengono l'ordinamento delle opzioni nei filtri
+        data[col] = data[col].cat.reorder_categories(data[col].cat.categories.sort_values())
+    return data
+
+@lru_cache(maxsize=None)
+def memoria_dataset(path:str)->tuple:
+    """
+        Memoria occupata dal dataset e stima della stessa con colonne di tipo object, in MB
+    """
+    data = fetch_data(path, **AMBITO)
+    memoria = data.memory_usage(deep=True)
+    memoria_object = memoria.copy()
+    for col in data.select_dtypes("category").columns:
+        # ogni riga di una colonna object tiene un puntatore e una propria stringa
+        dimensioni = np.array([sys.getsizeof(c) for c in data[col].cat.categories])
+        codici = data[col].cat.codes.to_numpy()
+        memoria_object[col] = 8 * len(codici) + dimensioni[codici[codici >= 0]].sum()
+    return memoria.sum() / 2**20, memoria_object.sum() / 2**20
+
+@lru_cache(maxsize=None)
+def fetch_geojson(path:str)->dict:
+    """
+        Raccoglie e pre-processa il dato geografico per la mappatura 
+    """
+    with open(path, "r") as file:
+        geojson = json.load(file)
+    return geojson
+
+# livelli di dettaglio della mappa: tolleranza di semplificazione in gradi
+TOLLERANZE_MAPPA = {"Basso": 0.02, "Medio": 0.005, "Alto": 0.001}
+
+def douglas_peucker(punti:np.ndarray, tolleranza:float)->np.ndarray:
+    """
+        Maschera dei punti mantenuti dalla semplificazione Douglas-Peucker di una polilinea,
+        con gli estremi sempre mantenuti
+    """
+    tieni = np.zeros(len(punti), dtype=bool)
+    tieni[[0, -1]] = True
+    pila = [(0, len(punti) - 1)]
+    while pila:
+        i, j = pila.pop()
+        if j <= i + 1:
+            continue
+        a, b = punti[i], punti[j]
+        intermedi = punti[i + 1:j] - a
+        lunghezza = np.hypot(*(b - a))
+        if lunghezza == 0:
+            distanze = np.hypot(intermedi[:, 0], intermedi[:, 1])
+        else:
+            distanze = np.abs((b - a)[0] * intermedi[:, 1] - (b - a)[1] * intermedi[:, 0]) / lunghezza
+        k = int(np.argmax(distanze))
+        if distanze[k] > tolleranza:
+            k += i + 1
+            tieni[k] = True
+            pila += [(i, k), (k, j)]
+    return tieni
+
+def semplifica_geojson(geojson:dict, tolleranza:float)->dict:
+    """
+        Semplifica i poligoni preservando i confini condivisi tra province: ogni anello è diviso
+        in archi nei punti in cui cambia l'insieme delle province che condividono il vertice,
+        e ogni arco è semplificato a estremi fissi, così lo stesso confine risulta identico
+        in entrambe le province. Le coordinate sono quantizzate in base alla tolleranza
+    """
+    decimali = int(np.ceil(-np.log10(tolleranza))) + 1
+    poligoni = []
+    for feature in geojson["features"]:
+        geometria = feature["geometry"]
+        parti = [geometria["coordinates"]] if geometria["type"] == "Polygon" else geometria["coordinates"]
+        poligoni.append([[np.round(np.asarray(anello, dtype=float)[:-1, :2], decimali) for anello in parte] for parte in parti])
+    # per ogni vertice, le province a cui appartiene
+    province_vertice = {}
+    for i, parti in enumerate(poligoni):
+        for parte in parti:
+            for anello in parte:
+                for vertice in map(tuple, anello):
+                    province_vertice.setdefault(vertice, set()).add(i)
+
+    features = []
+    for feature, parti in zip(geojson["features"], poligoni):
+        semplificate = []
+        for parte in parti:
+            anelli = []
+            for anello in parte:
+                insiemi = [province_vertice[v] for v in map(tuple, anello)]
+                n = len(anello)
+                nodi = [k for k in range(n) if insiemi[k] != insiemi[k - 1] or insiemi[k] != insiemi[(k + 1) % n]]
+                if not nodi:
+                    # anello senza confini condivisi variabili: nodi nel vertice minimo e nel più lontano
+                    primo = min(range(n), key=lambda k: tuple(anello[k]))
+                    nodi = sorted({primo, int(np.argmax(np.hypot(*(anello - anello[primo]).T)))})
+                tieni = np.zeros(n, dtype=bool)
+                for inizio, fine in zip(nodi, nodi[1:] + [nodi[0] + n]):
+                    indici = np.arange(inizio, fine + 1) % n
+                    # verso canonico dell'arco, perché le due province lo semplifichino allo stesso modo
+                    if tuple(anello[indici[0]]) > tuple(anello[indici[-1]]):
+                        indici = indici[::-1]
+                    tieni[indici[douglas_peucker(anello[indici], tolleranza)]] = True
+                ridotto = anello[tieni] if tieni.sum() >= 3 else anello
+                anelli.append(np.vstack([ridotto, ridotto[:1]]).tolist())
+            semplificate.append(anelli)
+        tipo = feature["geometry"]["type"]
+        features.append({
+            "type": "Feature",
+            "properties": dict(feature["properties"]),
+            "geometry": {"type": tipo, "coordinates": semplificate[0] if tipo == "Polygon" else semplificate}
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+@lru_cache(maxsize=None)
+def prepara_geojson(path:str, tolleranza:float)->dict:
+    """
+        Geometrie delle province semplificate e quantizzate, con prov_name normalizzato
+        come le chiavi PROVINCIA della mappa (str.title)
+    """
+    geojson = semplifica_geojson(fetch_geojson(path), tolleranza)
+    for feature in geojson["features"]:
+        feature["properties"]["prov_name"] = str.title(feature["properties"]["prov_name"])
+    return geojson
+
+# formati di export: estensione, mime type e compressione
+FORMATI_EXPORT = {
+    "CSV": ("csv", "text/csv", None),
+    "CSV compresso (gzip)": ("csv.gz", "application/gzip", "gzip"),
+    "CSV compresso (zstd)": ("csv.zst", "application/zstd", "zstd"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet", None)
+}
+
+def convert_df(df:pd.DataFrame, formato:str="CSV", righe_per_blocco:int=100_000)->bytes:
+    """
+        Serializza il DataFrame nel formato richiesto, a blocchi di righe,
+        senza costruire in memoria l'intero CSV come stringa
+    """
+    _, _, compressione = FORMATI_EXPORT[formato]
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    buffer = pa.BufferOutputStream()
+    stream = pa.CompressedOutputStream(buffer, compressione) if compressione else buffer
+    if formato == "Parquet":
+        writer = pq.ParquetWriter(stream, schema)
+    else:
+        writer = pa_csv.CSVWriter(stream, schema)
+    for inizio in range(0, len(df), righe_per_blocco):
+        blocco = df.iloc[inizio:inizio + righe_per_blocco]
+        writer.write_batch(pa.RecordBatch.from_pandas(blocco, schema=schema, preserve_index=False))
+    writer.close()
+    if compressione:
+        stream.close()
+    return buffer.getvalue().to_pybytes()
+
+def pagina_dati(data:pd.DataFrame, mask:np.ndarray, colonne:list, pagina:int, righe_per_pagina:int,
+                ordina_per:str=None, crescente:bool=True)->pd.DataFrame:
+    """
+        Restituisce solo le righe della pagina richiesta tra quelle selezionate dalla maschera,
+        eventualmente ordinate per una colonna (i valori mancanti in fondo)
+    """
+    posizioni = np.flatnonzero(mask)
+    if ordina_per:
+        valori = data[ordina_per].iloc[posizioni].reset_index(drop=True)
+        posizioni = posizioni[valori.sort_values(ascending=crescente, kind="stable").index.to_numpy()]
+    inizio = (pagina - 1) * righe_per_pagina
+    return data.iloc[posizioni[inizio:inizio + righe_per_pagina]][colonne]
+
+# colonne per cui si precalcola un bitmap per ogni valore
+COLONNE_INDICIZZATE = [
+    "REGIONE", "PROVINCIA", "MISSIONE", "ESITO", "MOTIVO_URGENZA", "CLASSE_IMPORTO",
+    "QUOTA_FEMMINILE", "QUOTA_GIOVANILE", "FLAG_MISURE_PREMIALI", "FLAG_URGENZA"
+]
+
+@lru_cache(maxsize=None)
+def build_filter_index(path:str)->dict:
+    """
+        Costruisce una sola volta l'indice dei filtri sulle righe del dataset
+    """
+    return indicizza(fetch_data(path, **AMBITO))
+
+def indicizza(data:pd.DataFrame)->dict:
+    """
+        Per ogni colonna filtrabile, un bitmap (np.packbits) delle righe per ciascun valore
+    """
+    index = {"n_righe": len(data), "colonne": {}}
+    for col in COLONNE_INDICIZZATE:
+        codes, uniques = pd.factorize(data[col])
+        bitmaps = {val: np.packbits(codes == i) for i, val in enumerate(uniques)}
+        if (codes == -1).any():
+            # i valori mancanti sono indicizzati sotto la chiave None
+            bitmaps[None] = np.packbits(codes == -1)
+        index["colonne"][col] = bitmaps
+    index["comuni"] = indicizza_comuni(data)
+    return index
+
+def normalizza_comune(nome)->str:
+    """
+        Nome del comune in forma canonica: maiuscolo, senza accenti, apostrofi e spazi superflui
+        (es. "Cantù ", "CANTU'" e "cantu" diventano "CANTU")
+    """
+    if not isinstance(nome, str):
+        return ""
+    nome = unicodedata.normalize("NFKD", nome).encode("ascii", "ignore").decode("ascii")
+    nome = re.sub(r"['`]", "", nome.upper())
+    return re.sub(r"[^A-Z0-9]+", " ", nome).strip()
+
+def indicizza_comuni(data:pd.DataFrame)->dict:
+    """
+        Indice dei comuni sui nomi normalizzati: array ordinato dei nomi (ricerca binaria per nome e prefisso),
+        nome originale da mostrare e posizioni delle righe di ciascun comune, contigue in "ordine"
+    """
+    comuni = data.COMUNE.astype("category")
+    normalizzati = np.array([normalizza_comune(nome) for nome in comuni.cat.categories], dtype=object)
+    nomi, codice_nome = np.unique(normalizzati, return_inverse=True)
+    # i comuni mancanti (codice -1) restano fuori da tutti gli intervalli
+    codice_riga = np.append(codice_nome, -1)[comuni.cat.codes.to_numpy()]
+    ordine = np.argsort(codice_riga, kind="stable")
+    return {
+        "nomi": nomi,
+        "etichette": pd.Series(comuni.cat.categories).groupby(codice_nome).first().to_numpy(),
+        "ordine": ordine,
+        "inizio": np.searchsorted(codice_riga[ordine], np.arange(len(nomi) + 1))
+    }
+
+def trova_comune(comuni:dict, nome:str)->int:
+    """
+        Posizione del comune nell'indice (ricerca binaria sul nome normalizzato), -1 se assente
+    """
+    chiave = normalizza_comune(nome)
+    k = int(np.searchsorted(comuni["nomi"], chiave))
+    return k if chiave and k < len(comuni["nomi"]) and comuni["nomi"][k] == chiave else -1
+
+def righe_comune(comuni:dict, nome:str)->np.ndarray:
+    """
+        Posizioni delle righe del comune indicato, vuoto se il comune non è presente
+    """
+    k = trova_comune(comuni, nome)
+    if k < 0:
+        return comuni["ordine"][:0]
+    return comuni["ordine"][comuni["inizio"][k]:comuni["inizio"][k + 1]]
+
+def suggerisci_comuni(comuni:dict, testo:str, n:int=5)->list:
+    """
+        Comuni che iniziano con il testo digitato (normalizzato); se nessuno, i nomi più simili
+    """
+    chiave = normalizza_comune(testo)
+    if not chiave:
+        return []
+    inizio = int(np.searchsorted(comuni["nomi"], chiave, side="left"))
+    fine = int(np.searchsorted(comuni["nomi"], chiave + "\uffff", side="left"))
+    trovati = list(range(inizio, min(fine, inizio + n)))
+    if not trovati:
+        vicini = difflib.get_close_matches(chiave, comuni["nomi"].tolist(), n=n)
+        trovati = [int(np.searchsorted(comuni["nomi"], nome)) for nome in vicini]
+    return [comuni["etichette"][k] for k in trovati]
+
+def bitmap_valori(index:dict, col:str, valori)->np.ndarray:
+    """
+        OR dei bitmap dei valori selezionati per una colonna
+    """
+    bitmaps = index["colonne"][col]
+    result = np.zeros((index["n_righe"] + 7) // 8, dtype=np.uint8)
+    for val in valori:
+        bitmap = bitmaps.get(None if pd.isna(val) else val)
+        if bitmap is not None:
+            np.bitwise_or(result, bitmap, out=result)
+    return result
+
+# valori delle quote nei filtri della sidebar
+INCLUDI_TUTTI = "Includi tutti"
+MAGGIORE_30 = "Maggiore del 30%"
+INFERIORE_30 = "Inferiore al 30%"
+
+@dataclass(frozen=True)
+class Filtri:
+    """
+        Filtri impostati nella sidebar, con gli stessi nomi di st.session_state["filters"].
+        È immutabile e confrontabile, quindi utilizzabile come chiave di cache
+    """
+    flag_premiali: bool = False
+    flag_urgenza: bool = False
+    filtro_quota_femminile: str = INCLUDI_TUTTI
+    filtro_quota_giovanile: str = INCLUDI_TUTTI
+    filtro_missioni: tuple = ()
+    filtro_importo: tuple = ()
+    filtro_regioni: tuple = ()
+    filtro_province: tuple = ()
+    filtro_comuni: str = ""
+    filtro_motivo_urgenza: tuple = ()
+    filtro_esito: tuple = ()
+
+    @classmethod
+    def da_dict(cls, filters:dict)->"Filtri":
+        """
+            Filtri normalizzati a partire dal dizionario della sidebar: selezioni multiple
+            ordinate e senza duplicati, nome del comune normalizzato (vedi normalizza_comune),
+            "Includi tutti" e valori vuoti come filtro assente
+        """
+        valori = {}
+        for campo in fields(cls):
+            valore = filters.get(campo.name, campo.default)
+            if campo.type is tuple:
+                # "Includi tutti" equivale a nessuna selezione
+                valore = () if INCLUDI_TUTTI in (valore or ()) else tuple(sorted(set(valore or ()), key=str))
+            elif campo.type is bool:
+                valore = bool(valore)
+            elif campo.name == "filtro_comuni":
+                valore = normalizza_comune(valore)
+            else:
+                valore = valore or campo.default
+            valori[campo.name] = valore
+        return cls(**valori)
+
+    def to_dict(self)->dict:
+        return {campo.name: getattr(self, campo.name) for campo in fields(self)}
+
+    def grafici(self)->"Filtri":
+        """
+            Filtri che determinano i dati dei grafici, che non tengono conto di misure premiali, urgenza e quote:
+            combinazioni che differiscono solo per questi filtri condividono gli stessi dati dei grafici
+        """
+        return replace(self, flag_premiali=False, flag_urgenza=False,
+                       filtro_quota_femminile=INCLUDI_TUTTI, filtro_quota_giovanile=INCLUDI_TUTTI)
+
+def maschera(bitmap:np.ndarray, n_righe:int)->np.ndarray:
+    """
+        Maschera booleana delle righe a partire dal bitmap compresso (un bit per riga)
+    """
+    return np.unpackbits(bitmap, count=n_righe).view(bool)
+
+def apply_filters(index:dict, filtri:Filtri, compressi:bool=False)->tuple:
+    """
+        Combina in AND i bitmap dei filtri impostati nella sidebar.
+        Restituisce le maschere booleane per i dati filtrati e per i dati dei grafici,
+        che non tengono conto di misure premiali, urgenza e quote.
+        Con compressi=True restituisce i bitmap (un bit per riga, vedi maschera), da conservare in cache
+    """
+    n_righe = index["n_righe"]
+    charts = np.full((n_righe + 7) // 8, 255, dtype=np.uint8)
+    if filtri.filtro_regioni:
+        charts &= bitmap_valori(index, "REGIONE", filtri.filtro_regioni)
+    if filtri.filtro_province:
+        charts &= bitmap_valori(index, "PROVINCIA", filtri.filtro_province)
+    if filtri.filtro_comuni:
+        comune = np.zeros(n_righe, dtype=bool)
+        comune[righe_comune(index["comuni"], filtri.filtro_comuni)] = True
+        charts &= np.packbits(comune)
+    if filtri.filtro_missioni:
+        charts &= bitmap_valori(index, "MISSIONE", filtri.filtro_missioni)
+    if filtri.filtro_motivo_urgenza:
+        charts &= bitmap_valori(index, "MOTIVO_URGENZA", filtri.filtro_motivo_urgenza)
+    if filtri.filtro_esito:
+        charts &= bitmap_valori(index, "ESITO", filtri.filtro_esito)
+    if filtri.filtro_importo:
+        charts &= bitmap_valori(index, "CLASSE_IMPORTO", filtri.filtro_importo)
+
+    filtered = charts.copy()
+    if filtri.flag_premiali:
+        filtered &= bitmap_valori(index, "FLAG_MISURE_PREMIALI", ["S"])
+    if filtri.flag_urgenza:
+        filtered &= bitmap_valori(index, "FLAG_URGENZA", [1])
+    for quota, col in ((filtri.filtro_quota_femminile, "QUOTA_FEMMINILE"), (filtri.filtro_quota_giovanile, "QUOTA_GIOVANILE")):
+        if quota == MAGGIORE_30:
+            filtered &= bitmap_valori(index, col, [">30%"])
+        elif quota == INFERIORE_30:
+            filtered &= ~bitmap_valori(index, col, [">30%"])
+
+    if compressi:
+        return filtered, charts
+    return maschera(filtered, n_righe), maschera(charts, n_righe)
+
+
+# dimensioni delle celle del cubo: tutte le colonne filtrabili e quelle usate nei grafici
+DIMENSIONI_CUBO = COLONNE_INDICIZZATE + ["COMUNE", "CODICE_MISSIONE", "COMPONENTE"]
+# raggruppamenti dei grafici, precalcolati sulle celle
+RAGGRUPPAMENTI = [("PROVINCIA",), ("REGIONE",), ("REGIONE", "MISSIONE"), ("CODICE_MISSIONE", "COMPONENTE")]
+
+@lru_cache(maxsize=None)
+def build_cube(path:str)->dict:
+    """
+        Costruisce il cubo di aggregazione: per ogni cella (combinazione delle DIMENSIONI_CUBO)
+        l'insieme dei CIG distinti, memorizzato come coppie ordinate (cella, codice CIG).
+        I CUP associati allo stesso CIG nella stessa cella collassano in un'unica coppia
+    """
+    data = fetch_data(path, **AMBITO)
+    cella = np.zeros(len(data), dtype=np.int64)
+    for col in DIMENSIONI_CUBO:
+        codici, valori = pd.factorize(data[col])
+        # i valori mancanti (-1) formano una cella a sé
+        cella = pd.factorize(cella * (len(valori) + 1) + codici + 1)[0]
+    cig = pd.factorize(data.CIG)[0]
+    n_cig = int(cig.max()) + 1
+    coppie = np.unique(cella[cig >= 0].astype(np.int64) * n_cig + cig[cig >= 0])
+    _, prima_riga = np.unique(cella, return_index=True)
+    celle = data.iloc[prima_riga][DIMENSIONI_CUBO].reset_index(drop=True)
+    gruppi = {}
+    for by in RAGGRUPPAMENTI:
+        raggruppate = celle.groupby(list(by), observed=True)
+        # le celle con chiave mancante non appartengono a nessun gruppo (-1), come in groupby
+        gruppi[by] = (raggruppate.ngroup().fillna(-1).astype(np.int64).to_numpy(), raggruppate.size().index)
+    return {
+        "celle": celle,
+        "indice": indicizza(celle),
+        "gruppi": gruppi,
+        "cella": (coppie // n_cig).astype(np.int32),
+        "cig": (coppie % n_cig).astype(np.int32),
+        "n_cig": n_cig
+    }
+
+def conta_cig(cube:dict, mask_celle:np.ndarray, by:tuple)->pd.Series:
+    """
+        Numero esatto di CIG distinti per gruppo, come groupby(by)["CIG"].nunique(),
+        ottenuto dall'unione degli insiemi di CIG delle celle selezionate
+    """
+    id_gruppo, gruppi = cube["gruppi"][by]
+    gruppo = id_gruppo[cube["cella"]]
+    selezione = mask_celle[cube["cella"]] & (gruppo >= 0)
+    coppie = np.unique(gruppo[selezione] * cube["n_cig"] + cube["cig"][selezione])
+    conteggi = np.bincount(coppie // cube["n_cig"], minlength=len(gruppi))
+    return pd.Series(conteggi, index=gruppi, name="CIG")[conteggi > 0]
+
+# indicatori di premialità: colonna e valore che li identificano
+INDICATORI = {
+    "premiali": ("FLAG_MISURE_PREMIALI", "S"),
+    "femminile": ("QUOTA_FEMMINILE", ">30%"),
+    "giovanile": ("QUOTA_GIOVANILE", ">30%")
+}
+
+def conta_cig_indicatori(cube:dict, mask_celle:np.ndarray, by:tuple)->pd.DataFrame:
+    """
+        In un solo passaggio sulle coppie del cubo, numero di CIG distinti per gruppo
+        sul totale (NUMERO_CIG) e per ciascun indicatore (CIG_FILTRATI), indicizzato per INDICATORE
+    """
+    id_gruppo, gruppi = cube["gruppi"][by]
+    gruppo = id_gruppo[cube["cella"]]
+    livelli = [mask_celle] + [mask_celle & (cube["celle"][col] == val).to_numpy() for col, val in INDICATORI.values()]
+    chiavi = []
+    for k, livello in enumerate(livelli):
+        selezione = livello[cube["cella"]] & (gruppo >= 0)
+        chiavi.append((gruppo[selezione] * len(livelli) + k) * cube["n_cig"] + cube["cig"][selezione])
+    coppie = np.unique(np.concatenate(chiavi))
+    conteggi = np.bincount(coppie // cube["n_cig"], minlength=len(gruppi) * len(livelli)).reshape(len(gruppi), len(livelli))
+    presenti = conteggi[:, 0] > 0
+    return pd.concat(
+        {
+            nome: pd.DataFrame({"NUMERO_CIG": conteggi[presenti, 0], "CIG_FILTRATI": conteggi[presenti, k + 1]}, index=gruppi[presenti])
+            for k, nome in enumerate(INDICATORI)
+        },
+        names=["INDICATORE"]
+    )
+
+def premialita(recap:pd.DataFrame, by:tuple)->tuple:
+    """
+        Dati dei grafici a barre per tutti gli indicatori, a partire dai conteggi di conta_cig_indicatori:
+        CIG filtrati per gruppo con la presenza sul totale, e somme per la prima dimensione con il rapporto da annotare
+    """
+    recap = recap.copy()
+    # i gruppi senza CIG filtrati restano vuoti, come nel merge esterno con il totale
+    recap["CIG_FILTRATI"] = recap["CIG_FILTRATI"].where(recap["CIG_FILTRATI"] > 0)
+    recap["PRESENCE_ON_TOTAL_CIGS"] = round((recap["CIG_FILTRATI"] / recap["NUMERO_CIG"])*100)
+    somme = recap.groupby(["INDICATORE", by[0]], observed=True)[["CIG_FILTRATI", "NUMERO_CIG"]].sum()
+    somme["RATIO"] = somme["CIG_FILTRATI"] / somme["NUMERO_CIG"]
+    return recap, somme
+
+# aggregati dei grafici: nome e raggruppamento
+AGGREGATI = {
+    "province": ("PROVINCIA",),
+    "regioni": ("REGIONE",),
+    "regioni_missioni": ("REGIONE", "MISSIONE"),
+    "missioni_componenti": ("CODICE_MISSIONE", "COMPONENTE")
+}
+
+def aggregati(path:str, filtri:Filtri, nomi:tuple=tuple(AGGREGATI))->dict:
+    """
+        Aggregati dei grafici indicati (di default tutti) per i filtri dati: CIG distinti per provincia sui dati filtrati,
+        e conteggi per indicatore per regione, regione/missione e missione/componente sui dati dei grafici
+    """
+    cube = build_cube(path)
+    celle_data, celle_charts = apply_filters(index=cube["indice"], filtri=filtri)
+    risultato = {}
+    for nome in nomi:
+        if nome == "province":
+            risultato[nome] = conta_cig(cube, celle_data, AGGREGATI[nome]).to_frame()
+        else:
+            risultato[nome] = conta_cig_indicatori(cube, celle_charts, AGGREGATI[nome])
+    return risultato
+
+def firma_file(path:str)->tuple:
+    """
+        Firma del dataset (file o cartella partizionata): data di modifica e dimensione di ogni file.
+        Cambia a ogni riscrittura del dataset, senza doverne rileggere il contenuto
+    """
+    if os.path.isfile(path):
+        stato = os.stat(path)
+        return ((path, stato.st_mtime_ns, stato.st_size),)
+    firma = []
+    for cartella, _, files in os.walk(path):
+        for nome in sorted(files):
+            stato = os.stat(os.path.join(cartella, nome))
+            firma.append((os.path.join(cartella, nome), stato.st_mtime_ns, stato.st_size))
+    return tuple(sorted(firma))
+
+def invalida_dati():
+    """
+        Svuota le cache di dataset, indice dei filtri e cubo, da ricalcolare alla prossima richiesta
+    """
+    for cache in (fetch_data, memoria_dataset, build_filter_index, build_cube):
+        cache.cache_clear()
+
+def dimensione_byte(oggetto)->int:
+    """
+        Memoria stimata di un risultato: array, tabelle, figure plotly, testi e contenitori che li includono
+    """
+    if hasattr(oggetto, "to_plotly_json"):
+        # figure plotly, stimate dal dizionario delle loro tracce e del layout
+        return dimensione_byte(oggetto.to_plotly_json())
+    if isinstance(oggetto, np.ndarray):
+        return oggetto.nbytes
+    if isinstance(oggetto, (pd.DataFrame, pd.Series)):
+        return int(np.sum(oggetto.memory_usage(deep=True)))
+    if isinstance(oggetto, dict):
+        return sys.getsizeof(oggetto) + sum(dimensione_byte(valore) for valore in oggetto.values())
+    if isinstance(oggetto, (list, tuple)):
+        return sys.getsizeof(oggetto) + sum(dimensione_byte(valore) for valore in oggetto)
+    return sys.getsizeof(oggetto)
+
+class CacheRisultati:
+    """
+        Cache LRU dei risultati per combinazione di filtri, condivisa da tutte le sessioni del processo.
+        La chiave è il dataset con i Filtri normalizzati, quindi selezioni equivalenti condividono la voce;
+        oltre le voci massime, o oltre i byte massimi (stimati con dimensione_byte all'inserimento),
+        si eliminano le voci usate meno di recente.
+        Se la firma del dataset cambia, la cache e i dati caricati vengono invalidati
+    """
+
+    def __init__(self, dimensione:int=64, byte_massimi:int=None):
+        self.dimensione = dimensione
+        self.byte_massimi = byte_massimi
+        self.risultati = OrderedDict()
+        self.pesi = {}
+        self.byte = 0
+        self.firme = {}
+        self.hit = 0
+        self.miss = 0
+        self.lock = threading.Lock()
+
+    def verifica(self, path:str):
+        """
+            Invalida i risultati e i dati caricati se il dataset è stato modificato
+        """
+        firma = firma_file(path)
+        with self.lock:
+            if path in self.firme and self.firme[path] != firma:
+                self.risultati.clear()
+                self.pesi.clear()
+                self.byte = 0
+                invalida_dati()
+            self.firme[path] = firma
+
+    def get(self, path:str, filtri:Filtri, calcola):
+        """
+            Risultato per i filtri dati: dalla cache se presente, altrimenti calcola(filtri)
+        """
+        self.verifica(path)
+        chiave = (path, filtri)
+        with self.lock:
+            if chiave in self.risultati:
+                self.hit += 1
+                self.risultati.move_to_end(chiave)
+                return self.risultati[chiave]
+            self.miss += 1
+        # il calcolo avviene fuori dal lock, per non bloccare le altre sessioni
+        risultato = calcola(filtri)
+        peso = dimensione_byte(risultato)
+        with self.lock:
+            self.byte += peso - self.pesi.get(chiave, 0)
+            self.risultati[chiave], self.pesi[chiave] = risultato, peso
+            self.risultati.move_to_end(chiave)
+            self.riduci()
+        return risultato
+
+    def aggiungi_byte(self, path:str, filtri:Filtri, byte:int):
+        """
+            Aggiorna la memoria stimata di una voce a cui è stato aggiunto un oggetto dopo il calcolo
+            (es. le figure dei grafici, costruite alla prima visualizzazione)
+        """
+        chiave = (path, filtri)
+        with self.lock:
+            if chiave not in self.pesi:
+                return
+            self.pesi[chiave] += byte
+            self.byte += byte
+            self.riduci()
+
+    def riduci(self):
+        """
+            Elimina le voci usate meno di recente oltre le voci o i byte massimi; da chiamare con il lock.
+            La voce più recente resta in cache anche se da sola supera i byte massimi
+        """
+        while len(self.risultati) > self.dimensione or (
+            self.byte_massimi is not None and self.byte > self.byte_massimi and len(self.risultati) > 1
+        ):
+            vecchia, _ = self.risultati.popitem(last=False)
+            self.byte -= self.pesi.pop(vecchia)
+
+    def statistiche(self)->dict:
+        with self.lock:
+            richieste = self.hit + self.miss
+            return {
+                "hit": self.hit,
+                "miss": self.miss,
+                "hit_rate": self.hit / richieste if richieste else 0.0,
+                "voci": len(self.risultati),
+                "dimensione": self.dimensione,
+                "byte": self.byte,
+                "byte_massimi": self.byte_massimi
+            }
+
+def aggregati_json(aggregati:dict)->dict:
+    """
+        Aggregati in formato JSON: per ognuno, colonne dell'indice, colonne dei valori e righe
+    """
+    return {
+        nome: {
+            "indice": list(tabella.index.names),
+            "colonne": list(tabella.columns),
+            "dati": json.loads(tabella.reset_index().to_json(orient="values"))
+        }
+        for nome, tabella in aggregati.items()
+    }
+
+def aggregati_da_json(risposta:dict)->dict:
+    """
+        Ricostruisce gli aggregati dalla risposta JSON dell'API (vedi aggregati_json)
+    """
+    return {
+        nome: pd.DataFrame(tabella["dati"], columns=tabella["indice"] + tabella["colonne"]).set_index(tabella["indice"])
+        for nome, tabella in risposta.items()
+    }
+
+
+# misure delle fasi dei rerun, attive con PNRR_STRUMENTAZIONE=1: le misure di ogni rerun sono scritte
+# come una riga JSON nel file PNRR_STRUMENTAZIONE_LOG (se non impostato, su stderr)
+STRUMENTAZIONE = os.environ.get("PNRR_STRUMENTAZIONE", "").lower() in ("1", "true", "si")
+logger_misure = logging.getLogger("pnrr.misure")
+if STRUMENTAZIONE and not logger_misure.handlers:
+    _handler = logging.FileHandler(os.environ["PNRR_STRUMENTAZIONE_LOG"]) \
+        if os.environ.get("PNRR_STRUMENTAZIONE_LOG") else logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger_misure.addHandler(_handler)
+    logger_misure.setLevel(logging.INFO)
+    logger_misure.propagate = False
+
+def rss()->int:
+    """
+        Memoria residente del processo in byte (da /proc, solo Linux), 0 se non disponibile
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+class Misure:
+    """
+        Tempo, righe in ingresso e in uscita e variazione della memoria residente
+        di ciascuna fase di un rerun. Se non attiva non misura nulla
+    """
+
+    def __init__(self, attiva:bool=STRUMENTAZIONE):
+        self.attiva = attiva
+        self.fasi = []
+        self.inizio, self.memoria = time.perf_counter(), rss() if attiva else 0
+
+    @contextmanager
+    def fase(self, nome:str, righe_in:int=None):
+        """
+            Misura il blocco come fase "nome"; le righe in uscita si impostano in misura["righe_out"]
+        """
+        misura = {"fase": nome, "righe_in": righe_in, "righe_out": None}
+        if not self.attiva:
+            yield misura
+            return
+        memoria, inizio = rss(), time.perf_counter()
+        try:
+            yield misura
+        finally:
+            misura["secondi"] = time.perf_counter() - inizio
+            misura["memoria_mb"] = (rss() - memoria) / 2**20
+            self.fasi.append(misura)
+
+    def chiudi(self):
+        """
+            Aggiunge la fase "rerun", con tempo e variazione di memoria dalla creazione delle misure
+        """
+        if self.attiva:
+            self.fasi.append({
+                "fase": "rerun", "righe_in": None, "righe_out": None,
+                "secondi": time.perf_counter() - self.inizio, "memoria_mb": (rss() - self.memoria) / 2**20
+            })
+
+    def log(self, **contesto):
+        """
+            Scrive le misure del rerun come una riga JSON, con il contesto dato (sessione, filtri, ...)
+        """
+        if self.attiva:
+            logger_misure.info(json.dumps(dict(contesto, fasi=self.fasi), default=str))
+
+class StoricoMisure:
+    """
+        Ultimi tempi di ogni fase, raccolti dai rerun di tutte le sessioni del processo
+    """
+
+    def __init__(self, dimensione:int=1000):
+        self.tempi = {}
+        self.dimensione = dimensione
+        self.lock = threading.Lock()
+
+    def aggiungi(self, misure:Misure):
+        with self.lock:
+            for misura in misure.fasi:
+                self.tempi.setdefault(misura["fase"], deque(maxlen=self.dimensione)).append(misura["secondi"])
+
+    def percentili(self)->pd.DataFrame:
+        """
+            Numero di misure e percentili dei tempi (in millisecondi) per fase
+        """
+        with self.lock:
+            tempi = {fase: np.array(valori) * 1000 for fase, valori in self.tempi.items()}
+        return pd.DataFrame(
+            {
+                fase: {"N": len(valori), "P50_MS": np.percentile(valori, 50), "P90_MS": np.percentile(valori, 90),
+                       "P99_MS": np.percentile(valori, 99), "MAX_MS": valori.max()}
+                for fase, valori in tempi.items()
+            }
+        ).T
@@ -0,0 +1,124 @@
+"""
+    API HTTP/JSON degli aggregati dei grafici, indipendente da Streamlit.
+
+    Espone gli stessi conteggi calcolati da App.py a partire dal cubo di aggregazione:
+        GET /api/aggregati               tutti gli aggregati
+        GET /api/<nome>                  un solo aggregato (province, regioni, regioni_missioni, missioni_componenti)
+        GET /api/cache                   hit e miss della cache dei risultati
+        GET /api/versioni                versioni mensili pubblicate nell'archivio (versioni.py)
+        GET /api/diff?da=&a=&livello=    variazioni tra due versioni per livello (REGIONE, MISSIONE, ...)
+    I filtri si passano nella query string con i nomi della sidebar, ripetendo il parametro
+    per le selezioni multiple, ad esempio:
+        /api/regioni?filtro_regioni=LAZIO&filtro_regioni=TOSCANA&flag_premiali=true
+
+    Avvio:
+        python api.py --porta 8502
+"""
+
+import argparse
+import json
+import os
+import traceback
+from dataclasses import fields
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import analisi
+import versioni
+
+
+def filtri_da_query(query:str)->analisi.Filtri:
+    """
+        Filtri a partire dalla query string: i flag accettano true/1, le selezioni multiple
+        sono i valori ripetuti del parametro, gli altri filtri l'ultimo valore passato
+    """
+    parametri = parse_qs(query)
+    filters = {}
+    for campo in fields(analisi.Filtri):
+        if campo.name not in parametri:
+            continue
+        valori = parametri[campo.name]
+        if campo.type is tuple:
+            filters[campo.name] = valori
+        elif campo.type is bool:
+            filters[campo.name] = valori[-1].lower() in ("true", "1")
+        else:
+            filters[campo.name] = valori[-1]
+    return analisi.Filtri.da_dict(filters)
+
+# cache dei risultati per filtri, condivisa dalle richieste del processo
+CACHE = analisi.CacheRisultati(
+    dimensione=int(os.environ.get("PNRR_CACHE_RISULTATI", 256)),
+    byte_massimi=int(float(os.environ.get("PNRR_CACHE_RISULTATI_MB", 256)) * 2**20)
+)
+
+def risposta(nome:str, filtri:analisi.Filtri)->bytes:
+    """
+        Corpo JSON della risposta; i filtri sono normalizzati, quindi richieste equivalenti condividono la cache
+    """
+    risultato = CACHE.get(
+        analisi.PATH_DATI, filtri,
+        lambda filtri: analisi.aggregati_json(analisi.aggregati(analisi.PATH_DATI, filtri))
+    )
+    if nome != "aggregati":
+        risultato = {nome: risultato[nome]}
+    return json.dumps(risultato).encode("utf-8")
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        try:
+            self.rispondi()
+        except Exception as e:
+            # errori imprevisti (dataset mancante, errori di pyarrow o del cubo): risposta 500,
+            # invece della connessione chiusa senza risposta da socketserver
+            self.log_error("Errore nella richiesta %s: %r", self.path, e)
+            traceback.print_exc()
+            self.send_error(500, "Errore interno nel calcolo della risposta")
+
+    def rispondi(self):
+        url = urlsplit(self.path)
+        nome = url.path.rstrip("/").removeprefix("/api/")
+        if nome == "cache":
+            self.invia(json.dumps(CACHE.statistiche()).encode("utf-8"))
+            return
+        if nome == "versioni":
+            self.invia(json.dumps(versioni.elenco_versioni()).encode("utf-8"))
+            return
+        if nome == "diff":
+            parametri = parse_qs(url.query)
+            try:
+                diff = versioni.diff_versioni(parametri["da"][-1], parametri["a"][-1], parametri.get("livello", ["REGIONE"])[-1])
+            except (KeyError, ValueError, FileNotFoundError) as e:
+                self.send_error(404, f"Versione o livello non trovato: {e}")
+                return
+            self.invia(json.dumps(analisi.aggregati_json({"diff": diff})).encode("utf-8"))
+            return
+        if not url.path.startswith("/api/") or (nome != "aggregati" and nome not in analisi.AGGREGATI):
+            self.send_error(404, "Aggregato non trovato")
+            return
+        try:
+            filtri = filtri_da_query(url.query)
+        except (TypeError, ValueError) as e:
+            self.send_error(400, str(e))
+            return
+        self.invia(risposta(nome, filtri))
+
+    def invia(self, corpo:bytes):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API HTTP/JSON degli aggregati PNRR")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8502)
+    args = parser.parse_args()
+    # dataset e cubo sono caricati una volta all'avvio, non alla prima richiesta
+    analisi.build_cube(analisi.PATH_DATI)
+    server = ThreadingHTTPServer((args.host, args.porta), Handler)
+    print(f"API in ascolto su http://{args.host}:{args.porta}/api/aggregati")
+    server.serve_forever()
@@ -0,0 +1,306 @@
+"""
+    Benchmark del percorso dei dati della App su dataset sintetici con la forma di cig_cup_final.parquet.
+
+    Per ogni dimensione richiesta genera un dataset (colonne e tipi dello SCHEMA di etl.py,
+    relazione molti a molti tra CIG e CUP, cardinalità realistiche di Regioni, Province e Comuni)
+    e un GeoJSON sintetico delle province, poi misura le fasi del rerun della App:
+    caricamento, indice dei filtri, cubo, filtri, aggregati dei grafici, conteggi distinti,
+    mappa coropletica ed export.
+    Per ogni fase riporta il tempo (minimo e mediana sulle ripetizioni) e il picco di memoria
+    del processo rispetto all'inizio della fase (campionato da /proc, solo Linux), in JSON.
+
+    Uso:
+        python bench.py --righe 100000 1000000 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import pyarrow as pa
+import pyarrow.parquet as pq
+import analisi
+import etl
+
+# regioni con il numero di province (107 in totale)
+REGIONI = {
+    "ABRUZZO": 4, "BASILICATA": 2, "CALABRIA": 5, "CAMPANIA": 5, "EMILIA-ROMAGNA": 9,
+    "FRIULI-VENEZIA GIULIA": 4, "LAZIO": 5, "LIGURIA": 4, "LOMBARDIA": 12, "MARCHE": 5,
+    "MOLISE": 2, "PIEMONTE": 8, "PUGLIA": 6, "SARDEGNA": 5, "SICILIA": 9, "TOSCANA": 10,
+    "TRENTINO-ALTO ADIGE": 2, "UMBRIA": 2, "VALLE D'AOSTA": 1, "VENETO": 7
+}
+N_COMUNI = 7900
+# missioni con il numero di componenti
+MISSIONI = {
+    "M1": ("DIGITALIZZAZIONE, INNOVAZIONE, COMPETITIVITÀ, CULTURA E TURISMO", 3),
+    "M2": ("RIVOLUZIONE VERDE E TRANSIZIONE ECOLOGICA", 4),
+    "M3": ("INFRASTRUTTURE PER UNA MOBILITÀ SOSTENIBILE", 2),
+    "M4": ("ISTRUZIONE E RICERCA", 2),
+    "M5": ("INCLUSIONE E COESIONE", 3),
+    "M6": ("SALUTE", 2)
+}
+ESITI = ["AGGIUDICATA", "IN CORSO", "NON AGGIUDICATA", "DESERTA", "ANNULLATA"]
+MOTIVI_URGENZA = ["EVENTI CALAMITOSI", "SCADENZE PNRR", "TUTELA DELLA SALUTE", "ALTRO"]
+
+# combinazioni di filtri misurate, con i nomi della sidebar
+CASI_FILTRI = {
+    "nessuno": {},
+    "regione": {"filtro_regioni": ["LAZIO"]},
+    "premiali": {"flag_premiali": True},
+    "comune": {"filtro_comuni": "COMUNE 0000"},
+    "combinato": {"filtro_regioni": ["LOMBARDIA", "VENETO"], "filtro_missioni": [MISSIONI["M2"][0]],
+                  "filtro_quota_femminile": analisi.MAGGIORE_30}
+}
+
+
+def codici(prefisso:str, n:int)->pd.Index:
+    """
+        Codici identificativi distinti di lunghezza fissa (es. CIG "Z000000001")
+    """
+    return pd.Index(np.char.add(prefisso, np.char.zfill(np.arange(n).astype(str), 9)))
+
+def categoria(indici:np.ndarray, valori:list)->pd.Categorical:
+    """
+        Colonna categorica dagli indici dei valori (-1 per i valori mancanti)
+    """
+    return pd.Categorical.from_codes(indici, categories=valori)
+
+def genera_dataset(n_righe:int, seed:int=0)->pd.DataFrame:
+    """
+        Dataset sintetico con una riga per coppia CIG-CUP. Ogni CUP ha una localizzazione
+        (con pochi Comuni molto frequenti, come le grandi città) e una missione/componente,
+        ogni CIG esito, urgenza, quote e importo; CIG e CUP si ripetono su più righe
+    """
+    rng = np.random.default_rng(seed)
+    n_cig = max(1, int(n_righe / 1.6))
+    n_cup = max(1, int(n_righe / 2.5))
+
+    # territorio: province assegnate alle regioni, comuni alle province
+    regione_provincia = np.repeat(np.arange(len(REGIONI)), list(REGIONI.values()))
+    province = [f"PROVINCIA {i:03d}" for i in range(len(regione_provincia))]
+    provincia_comune = rng.integers(0, len(province), N_COMUNI)
+    comuni = [f"COMUNE {i:04d}" for i in range(N_COMUNI)]
+    peso_comune = 1 / np.arange(1, N_COMUNI + 1) ** 1.1
+    componenti = [(codice, nome, f"{codice}C{k}") for codice, (nome, n) in MISSIONI.items() for k in range(1, n + 1)]
+
+    # attributi dei CUP
+    comune_cup = rng.choice(N_COMUNI, n_cup, p=peso_comune / peso_comune.sum())
+    comune_cup[rng.random(n_cup) < 0.01] = -1
+    provincia_cup = np.where(comune_cup >= 0, provincia_comune[comune_cup], -1)
+    regione_cup = np.where(provincia_cup >= 0, regione_provincia[provincia_cup], -1)
+    componente_cup = rng.integers(0, len(componenti), n_cup)
+
+    # attributi dei CIG
+    importo_cig = np.round(rng.lognormal(mean=11.5, sigma=1.8, size=n_cig), 2)
+
+    # righe: coppie CIG-CUP distinte
+    coppie = np.unique(rng.integers(0, n_cig, n_righe).astype(np.int64) * n_cup + rng.integers(0, n_cup, n_righe))
+    cig, cup = coppie // n_cup, coppie % n_cup
+    missione = np.array([list(MISSIONI).index(codice) for codice, _, _ in componenti])[componente_cup[cup]]
+    return pd.DataFrame({
+        "CIG": pd.Categorical.from_codes(cig, categories=codici("Z", n_cig)),
+        "CUP": pd.Categorical.from_codes(cup, categories=codici("J", n_cup)),
+        "REGIONE": categoria(regione_cup[cup], list(REGIONI)),
+        "PROVINCIA": categoria(provincia_cup[cup], province),
+        "COMUNE": categoria(comune_cup[cup], comuni),
+        "MISSIONE": categoria(missione, [nome for nome, _ in MISSIONI.values()]),
+        "CODICE_MISSIONE": categoria(missione, list(MISSIONI)),
+        "COMPONENTE": categoria(componente_cup[cup], [componente for _, _, componente in componenti]),
+        "ESITO": categoria(rng.integers(0, len(ESITI), n_cig)[cig], ESITI),
+        "MOTIVO_URGENZA": categoria(rng.integers(-3, len(MOTIVI_URGENZA), n_cig).clip(-1)[cig], MOTIVI_URGENZA),
+        "IMPORTO": importo_cig[cig],
+        "CLASSE_IMPORTO": pd.cut(importo_cig[cig], bins=etl.SOGLIE_IMPORTO, labels=etl.CLASSI_IMPORTO),
+        "QUOTA_FEMMINILE": categoria(rng.integers(-1, 2, n_cig)[cig], [">30%", "<30%"]),
+        "QUOTA_GIOVANILE": categoria(rng.integers(-1, 2, n_cig)[cig], [">30%", "<30%"]),
+        "FLAG_MISURE_PREMIALI": categoria(rng.integers(-1, 2, n_cig)[cig], ["S", "N"]),
+        "FLAG_URGENZA": rng.integers(0, 2, n_cig)[cig]
+    })
+
+def scrivi_dataset(data:pd.DataFrame, path:str):
+    """
+        Scrive il dataset con lo schema del dataset prodotto da etl.py (colonne testuali, non dizionari)
+    """
+    pq.write_table(pa.Table.from_pandas(data, preserve_index=False).cast(etl.SCHEMA), path)
+
+def genera_geojson(n_province:int, punti_per_lato:int=60)->dict:
+    """
+        GeoJSON sintetico delle province: una griglia di celle con lati ondulati, condivisi tra
+        celle vicine (come i confini reali), e prov_name uguale ai nomi delle province generate
+    """
+    colonne = int(np.ceil(np.sqrt(n_province)))
+    t = np.linspace(0, 1, punti_per_lato)
+    onda = 0.05 * np.sin(np.pi * t) * np.sin(7 * np.pi * t)
+
+    def lato(x0, y0, x1, y1):
+        # punti del lato da (x0, y0) a (x1, y1), calcolati sempre nello stesso verso
+        if (x1, y1) < (x0, y0):
+            return lato(x1, y1, x0, y0)[::-1]
+        if y0 == y1:
+            return np.column_stack([x0 + (x1 - x0) * t, y0 + onda])
+        return np.column_stack([x0 + onda, y0 + (y1 - y0) * t])
+
+    features = []
+    for i in range(n_province):
+        x, y = 7 + i % colonne, 37 + i // colonne
+        angoli = [(x, y), (x + 1, y), (x + 1, y + 1), (x, y + 1), (x, y)]
+        anello = []
+        for (x0, y0), (x1, y1) in zip(angoli[:-1], angoli[1:]):
+            # ogni lato senza il suo ultimo punto, che è il primo del lato successivo
+            anello.extend(lato(x0, y0, x1, y1)[:-1].tolist())
+        anello.append(anello[0])
+        features.append({
+            "type": "Feature",
+            "properties": {"prov_name": f"PROVINCIA {i:03d}"},
+            "geometry": {"type": "Polygon", "coordinates": [anello]}
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+class PiccoMemoria:
+    """
+        Picco della memoria residente durante il blocco, rispetto all'inizio, campionato in un thread
+    """
+
+    def __init__(self, intervallo:float=0.002):
+        self.intervallo = intervallo
+
+    def __enter__(self):
+        self.inizio = self.picco = analisi.rss()
+        self.attivo = True
+        self.thread = threading.Thread(target=self.campiona, daemon=True)
+        self.thread.start()
+        return self
+
+    def campiona(self):
+        while self.attivo:
+            self.picco = max(self.picco, analisi.rss())
+            time.sleep(self.intervallo)
+
+    def __exit__(self, *args):
+        self.attivo = False
+        self.thread.join()
+        self.picco = max(self.picco, analisi.rss())
+
+    @property
+    def mb(self):
+        return (self.picco - self.inizio) / 2**20 if self.inizio else None
+
+def misura(fase:str, funzione, ripetizioni:int, prepara=None)->tuple:
+    """
+        Esegue la fase più volte (prepara() prima di ognuna, fuori dalla misura);
+        restituisce il risultato dell'ultima esecuzione e le misure
+    """
+    tempi, picchi = [], []
+    for _ in range(ripetizioni):
+        if prepara:
+            prepara()
+        with PiccoMemoria() as memoria:
+            inizio = time.perf_counter()
+            risultato = funzione()
+            tempi.append(time.perf_counter() - inizio)
+        picchi.append(memoria.mb)
+    return risultato, {
+        "fase": fase,
+        "secondi_min": min(tempi),
+        "secondi_mediana": statistics.median(tempi),
+        "picco_mb": max(picchi) if None not in picchi else None
+    }
+
+def benchmark(n_righe:int, cartella:str, ripetizioni:int=3, seed:int=0, formati:tuple=("CSV",))->list:
+    """
+        Misure delle fasi della App per un dataset sintetico di n_righe righe
+    """
+    path = os.path.join(cartella, f"cig_cup_{n_righe}.parquet")
+    path_geojson = os.path.join(cartella, "geojson_province.json")
+    scrivi_dataset(genera_dataset(n_righe, seed), path)
+    with open(path_geojson, "w") as f:
+        json.dump(genera_geojson(sum(REGIONI.values())), f)
+    misure = []
+
+    def svuota_mappa():
+        analisi.fetch_geojson.cache_clear()
+        analisi.prepara_geojson.cache_clear()
+
+    # avvio: dataset, indice dei filtri e cubo, misurati a cache vuote
+    dataset, m = misura("caricamento", lambda: analisi.fetch_data(path, **analisi.AMBITO), ripetizioni, analisi.invalida_dati)
+    misure.append(m)
+    index, m = misura("indice_filtri", lambda: analisi.indicizza(dataset), ripetizioni)
+    misure.append(m)
+    _, m = misura("cubo", lambda: analisi.build_cube(path), ripetizioni, analisi.build_cube.cache_clear)
+    misure.append(m)
+    figura, m = misura("mappa_base", lambda: go.Figure(go.Choropleth(
+        geojson=analisi.prepara_geojson(path_geojson, analisi.TOLLERANZE_MAPPA["Medio"]),
+        featureidkey="properties.prov_name"
+    )), ripetizioni, svuota_mappa)
+    misure.append(m)
+    dataset = analisi.fetch_data(path, **analisi.AMBITO)
+
+    # rerun: per ogni combinazione di filtri, le fasi calcolate dalla App (senza cache dei risultati)
+    for caso, filters in CASI_FILTRI.items():
+        filtri = analisi.Filtri.da_dict(filters)
+        (mask_data, _), m = misura("filtri", lambda: analisi.apply_filters(index, filtri), ripetizioni)
+        misure.append(dict(m, caso=caso, righe_filtrate=int(mask_data.sum())))
+        aggregati, m = misura("aggregati", lambda: analisi.aggregati(path, filtri), ripetizioni)
+        misure.append(dict(m, caso=caso))
+        data = dataset[mask_data]
+        _, m = misura("riepilogo", lambda: (data.CIG.nunique(), data.CUP.nunique(), data.COMUNE.nunique()), ripetizioni)
+        misure.append(dict(m, caso=caso))
+
+        def mappa():
+            province = aggregati["province"]
+            figura.update_traces(
+                locations=province.index.map(str.title), z=province["CIG"], zmin=0, zmax=max(province["CIG"], default=0)
+            )
+            return figura.to_json()
+
+        _, m = misura("mappa", mappa, ripetizioni)
+        misure.append(dict(m, caso=caso))
+        for formato in formati:
+            file, m = misura("export", lambda: analisi.convert_df(data, formato=formato), ripetizioni)
+            misure.append(dict(m, caso=caso, formato=formato, mb_file=len(file) / 2**20))
+
+    for m in misure:
+        m["righe"] = len(dataset)
+    os.remove(path)
+    return misure
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del percorso dei dati della App su dataset sintetici")
+    parser.add_argument("--righe", type=int, nargs="+", default=[100_000, 1_000_000],
+                        help="dimensioni dei dataset sintetici (es. 100000 1000000 10000000)")
+    parser.add_argument("--ripetizioni", type=int, default=3, help="esecuzioni di ogni fase")
+    parser.add_argument("--formati", nargs="+", default=["CSV"], choices=list(analisi.FORMATI_EXPORT),
+                        help="formati di export misurati")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cartella", help="cartella dei dataset generati (default: temporanea)")
+    parser.add_argument("--output", help="file JSON dei risultati (default: stampati a video)")
+    args = parser.parse_args()
+
+    cartella = args.cartella or tempfile.mkdtemp(prefix="bench_pnrr_")
+    os.makedirs(cartella, exist_ok=True)
+    risultati = {
+        "ambiente": {
+            "python": platform.python_version(), "sistema": platform.platform(), "cpu": os.cpu_count(),
+            "numpy": np.__version__, "pandas": pd.__version__, "pyarrow": pa.__version__
+        },
+        "misure": []
+    }
+    for n_righe in args.righe:
+        misure = benchmark(n_righe, cartella, args.ripetizioni, args.seed, tuple(args.formati))
+        for m in misure:
+            print(f"{n_righe:>10} {m['fase']:<14} {m.get('caso', ''):<10} {m['secondi_mediana']:9.4f} s"
+                  + (f" {m['picco_mb']:9.1f} MB" if m["picco_mb"] is not None else ""), file=sys.stderr)
+        risultati["misure"].extend(misure)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(risultati, f, indent=2)
+    else:
+        print(json.dumps(risultati, indent=2))
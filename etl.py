@@ -0,0 +1,283 @@
+"""
+    Pipeline ETL offline che costruisce data/cig_cup_final.parquet a partire dagli export
+    locali di ANAC, OpenCUP e OpenPNRR.
+
+    File di input (CSV, tutte le colonne lette come testo):
+    * ANAC: una riga per coppia CIG-CUP, con le colonne COLONNE_ANAC
+    * OpenCUP: localizzazione dei CUP, con le colonne COLONNE_OPENCUP
+    * OpenPNRR: missione e componente dei CUP, con le colonne COLONNE_OPENPNRR
+
+    Il risultato è una cartella di file parquet (part-XX.parquet), uno per bucket di CIG,
+    leggibile direttamente da fetch_data. L'aggiornamento è incrementale: per ogni CIG e CUP
+    si conserva un hash del contenuto (_stato_cig.parquet, _stato_cup.parquet) e vengono
+    riscritti solo i bucket che contengono CIG nuovi, modificati, rimossi o collegati a CUP modificati.
+    L'export ANAC è letto a blocchi di righe, così la memoria dipende dal numero di CIG e CUP
+    e non dalle righe dell'export (oltre a un hash di 8 byte per riga, per riconoscere le righe ripetute).
+
+    Uso:
+        python etl.py --anac anac.csv --opencup opencup.csv --openpnrr openpnrr.csv
+"""
+import argparse
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import versioni
+
+COLONNE_ANAC = [
+    "CIG", "CUP", "IMPORTO", "ESITO", "MOTIVO_URGENZA", "FLAG_URGENZA",
+    "FLAG_MISURE_PREMIALI", "QUOTA_FEMMINILE", "QUOTA_GIOVANILE"
+]
+COLONNE_OPENCUP = ["CUP", "REGIONE", "PROVINCIA", "COMUNE"]
+COLONNE_OPENPNRR = ["CUP", "MISSIONE", "CODICE_MISSIONE", "COMPONENTE"]
+
+# schema del dataset finale
+SCHEMA = pa.schema(
+    [(col, pa.string()) for col in ["CIG", "CUP", "REGIONE", "PROVINCIA", "COMUNE", "MISSIONE",
+                                    "CODICE_MISSIONE", "COMPONENTE", "ESITO", "MOTIVO_URGENZA"]]
+    + [("IMPORTO", pa.float64()), ("CLASSE_IMPORTO", pa.string())]
+    + [(col, pa.string()) for col in ["QUOTA_FEMMINILE", "QUOTA_GIOVANILE", "FLAG_MISURE_PREMIALI"]]
+    + [("FLAG_URGENZA", pa.int64())]
+)
+# classi di importo: BASSA sotto 100.000€, MEDIA fino a 1.000.000€, ALTA oltre
+SOGLIE_IMPORTO = [-np.inf, 100_000, 1_000_000, np.inf]
+CLASSI_IMPORTO = ["BASSA", "MEDIA", "ALTA"]
+
+
+def somma_per_chiave(chiavi:np.ndarray, valori:np.ndarray)->pd.Series:
+    """
+        Somma (modulo 2^64) dei valori per chiave: combinando gli hash delle righe
+        si ottiene un hash del contenuto indipendente dall'ordine delle righe
+    """
+    if len(chiavi) == 0:
+        return pd.Series(dtype=np.uint64)
+    ordine = np.argsort(chiavi, kind="stable")
+    ordinate = chiavi[ordine]
+    inizi = np.flatnonzero(np.r_[True, ordinate[1:] != ordinate[:-1]])
+    return pd.Series(np.add.reduceat(valori[ordine].astype(np.uint64), inizi), index=ordinate[inizi])
+
+def hash_righe(df:pd.DataFrame)->np.ndarray:
+    """
+        Hash del contenuto di ogni riga
+    """
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+def bucket_cig(cig, n_bucket:int)->np.ndarray:
+    """
+        Bucket (file di output) di ciascun CIG, stabile tra un'esecuzione e l'altra
+    """
+    return (pd.util.hash_pandas_object(pd.Series(cig, dtype=object), index=False).to_numpy() % n_bucket).astype(int)
+
+def normalizza_testo(serie:pd.Series)->pd.Series:
+    """
+        Nomi geografici in maiuscolo e senza spazi superflui, come li confronta la App
+    """
+    return serie.str.strip().str.upper()
+
+def carica_lookup(opencup:str, openpnrr:str, sep:str)->tuple:
+    """
+        Tabelle dei CUP (localizzazione e missione) e hash del loro contenuto per CUP
+    """
+    localizzazioni = pd.read_csv(opencup, sep=sep, usecols=COLONNE_OPENCUP, dtype=str).dropna(subset=["CUP"]).drop_duplicates()
+    for col in ["REGIONE", "PROVINCIA", "COMUNE"]:
+        localizzazioni[col] = normalizza_testo(localizzazioni[col])
+    missioni = pd.read_csv(openpnrr, sep=sep, usecols=COLONNE_OPENPNRR, dtype=str).dropna(subset=["CUP"]).drop_duplicates()
+    hash_cup = somma_per_chiave(
+        np.concatenate([localizzazioni.CUP.to_numpy(dtype=object), missioni.CUP.to_numpy(dtype=object)]),
+        np.concatenate([hash_righe(localizzazioni), hash_righe(missioni)])
+    )
+    return localizzazioni, missioni, hash_cup
+
+def leggi_stato(output:str, nome:str)->pd.Series:
+    """
+        Hash dell'esecuzione precedente (vuoto alla prima esecuzione)
+    """
+    path = os.path.join(output, f"_stato_{nome}.parquet")
+    if not os.path.exists(path):
+        return pd.Series(dtype=np.uint64)
+    stato = pd.read_parquet(path)
+    return pd.Series(stato["HASH"].to_numpy(), index=stato[nome.upper()].to_numpy())
+
+def scrivi_stato(output:str, nome:str, hash_:pd.Series):
+    pd.DataFrame({nome.upper(): hash_.index, "HASH": hash_.to_numpy()}).to_parquet(
+        os.path.join(output, f"_stato_{nome}.parquet"), index=False
+    )
+
+def modificati(hash_nuovo:pd.Series, hash_vecchio:pd.Series)->set:
+    """
+        Chiavi nuove, rimosse o con contenuto diverso
+    """
+    comuni = hash_nuovo.index.intersection(hash_vecchio.index)
+    diversi = comuni[hash_nuovo[comuni].to_numpy() != hash_vecchio[comuni].to_numpy()]
+    return set(hash_nuovo.index.difference(comuni)) | set(hash_vecchio.index.difference(comuni)) | set(diversi)
+
+def leggi_anac(anac:str, sep:str, righe_per_blocco:int):
+    """
+        Export ANAC letto a blocchi di righe, scartando le righe senza CIG
+    """
+    for blocco in pd.read_csv(anac, sep=sep, usecols=COLONNE_ANAC, dtype=str, chunksize=righe_per_blocco):
+        yield blocco.dropna(subset=["CIG"])
+
+def righe_uniche(blocchi, ripetute:np.ndarray):
+    """
+        Blocchi di righe ANAC senza duplicati: le righe con hash in ripetute sono tenute solo alla prima
+        occorrenza, anche se le copie sono in blocchi diversi, così il risultato non dipende dalla dimensione dei blocchi
+    """
+    viste = set()
+    for blocco in blocchi:
+        hash_ = hash_righe(blocco)
+        tieni = ~pd.Series(hash_).duplicated().to_numpy()
+        for i in np.flatnonzero(tieni & np.isin(hash_, ripetute)):
+            tieni[i] = hash_[i] not in viste
+            viste.add(hash_[i])
+        yield blocco[tieni]
+
+def trasforma(blocco:pd.DataFrame, localizzazioni:pd.DataFrame, missioni:pd.DataFrame)->pd.DataFrame:
+    """
+        Unisce un blocco di righe ANAC (senza duplicati, vedi righe_uniche) con localizzazione e missione dei CUP
+        (relazione molti a molti) e deriva le colonne usate dalla App
+    """
+    blocco = blocco.assign(
+        IMPORTO=pd.to_numeric(blocco["IMPORTO"], errors="coerce"),
+        FLAG_URGENZA=pd.to_numeric(blocco["FLAG_URGENZA"], errors="coerce").astype("Int64")
+    )
+    blocco = blocco.assign(
+        CLASSE_IMPORTO=pd.cut(blocco["IMPORTO"], bins=SOGLIE_IMPORTO, labels=CLASSI_IMPORTO).astype(object)
+    )
+    finale = blocco.merge(localizzazioni, on="CUP", how="left").merge(missioni, on="CUP", how="left")
+    return finale[SCHEMA.names]
+
+def esegui(anac:str, opencup:str, openpnrr:str, output:str, n_bucket:int=32, sep:str=",", righe_per_blocco:int=200_000):
+    """
+        Aggiorna incrementalmente il dataset partizionato in output
+    """
+    if os.path.isfile(output):
+        raise ValueError(f"{output} è un file: l'ETL scrive una cartella di file parquet")
+    os.makedirs(output, exist_ok=True)
+    localizzazioni, missioni, hash_cup = carica_lookup(opencup, openpnrr, sep)
+    cup_modificati = modificati(hash_cup, leggi_stato(output, "cup"))
+
+    # primo passaggio: hash del contenuto per CIG, CIG collegati a CUP modificati e righe ripetute
+    parziali, cig_da_cup, hash_anac = [], set(), [np.array([], dtype=np.uint64)]
+    for blocco in leggi_anac(anac, sep, righe_per_blocco):
+        hash_anac.append(hash_righe(blocco))
+        parziali.append(somma_per_chiave(blocco.CIG.to_numpy(dtype=object), hash_anac[-1]))
+        cig_da_cup.update(blocco.CIG[blocco.CUP.isin(cup_modificati)])
+    parziali = pd.concat(parziali) if parziali else pd.Series(dtype=np.uint64)
+    hash_anac, ripetizioni = np.unique(np.concatenate(hash_anac), return_counts=True)
+    ripetute = hash_anac[ripetizioni > 1]
+    del hash_anac, ripetizioni
+    hash_cig = somma_per_chiave(parziali.index.to_numpy(dtype=object), parziali.to_numpy())
+    da_riscrivere = modificati(hash_cig, leggi_stato(output, "cig")) | cig_da_cup
+    if not da_riscrivere:
+        print("Nessun CIG nuovo o modificato: dataset già aggiornato")
+        scrivi_stato(output, "cup", hash_cup)
+        return
+
+    # i bucket toccati vengono riscritti: prima le righe invariate, poi quelle ricalcolate
+    bucket_toccati = set(bucket_cig(list(da_riscrivere), n_bucket))
+    writers = {}
+    for bucket in bucket_toccati:
+        path = os.path.join(output, f"part-{bucket:02d}.parquet")
+        writers[bucket] = pq.ParquetWriter(os.path.join(output, f".part-{bucket:02d}.parquet.tmp"), SCHEMA)
+        if os.path.exists(path):
+            vecchio = pq.read_table(path)
+            invariati = ~pd.Series(vecchio.column("CIG").to_pylist()).isin(da_riscrivere).to_numpy()
+            writers[bucket].write_table(vecchio.filter(pa.array(invariati)))
+
+    # secondo passaggio: join a blocchi delle sole righe da riscrivere
+    n_righe = 0
+    blocchi = (blocco[blocco.CIG.isin(da_riscrivere)] for blocco in leggi_anac(anac, sep, righe_per_blocco))
+    for blocco in righe_uniche(blocchi, ripetute):
+        if blocco.empty:
+            continue
+        finale = trasforma(blocco, localizzazioni, missioni)
+        for bucket, righe in finale.groupby(bucket_cig(finale.CIG, n_bucket)):
+            writers[bucket].write_table(pa.Table.from_pandas(righe, schema=SCHEMA, preserve_index=False))
+        n_righe += len(finale)
+
+    for bucket, writer in writers.items():
+        writer.close()
+        tmp = os.path.join(output, f".part-{bucket:02d}.parquet.tmp")
+        path = os.path.join(output, f"part-{bucket:02d}.parquet")
+        if pq.read_metadata(tmp).num_rows == 0:
+            os.remove(tmp)
+            if os.path.exists(path):
+                os.remove(path)
+        else:
+            os.replace(tmp, path)
+    scrivi_stato(output, "cig", hash_cig)
+    scrivi_stato(output, "cup", hash_cup)
+    print(f"CIG aggiornati: {len(da_riscrivere)}, righe scritte: {n_righe}, bucket riscritti: {len(bucket_toccati)} su {n_bucket}")
+
+def contiene(cartella:str, path:str)->bool:
+    """
+        Vero se path coincide con cartella o si trova al suo interno
+    """
+    cartella, path = os.path.realpath(cartella), os.path.realpath(path)
+    return os.path.commonpath([cartella, path]) == cartella
+
+def partiziona(input:str, output:str, per_missione:bool=False, righe_per_gruppo:int=50_000,
+               protette:tuple=(versioni.PATH_VERSIONI,)):
+    """
+        Riscrive il dataset partizionato per REGIONE (e opzionalmente MISSIONE), in formato hive,
+        con le righe di ogni regione ordinate per MISSIONE, CLASSE_IMPORTO, PROVINCIA e COMUNE:
+        le statistiche dei row group permettono alla App di saltare quelli esclusi dai filtri.
+        Le regioni sono elaborate una alla volta, così la memoria è limitata alla regione più grande.
+        La cartella di output viene sostituita, quindi non può coincidere con l'input o con le cartelle protette
+        (l'archivio delle versioni), né contenerle o esserne contenuta
+    """
+    for path in (input,) + tuple(protette):
+        if contiene(output, path) or contiene(path, output):
+            raise ValueError(f"Cartella del dataset partizionato non valida: {output} si sovrappone a {path}")
+    sorgente = ds.dataset(input, format="parquet", partitioning="hive")
+    colonne_partizione = ["REGIONE", "MISSIONE"] if per_missione else ["REGIONE"]
+    partizionamento = ds.partitioning(pa.schema([(col, pa.string()) for col in colonne_partizione]), flavor="hive")
+    ordinamento = [(col, "ascending") for col in ["MISSIONE", "CLASSE_IMPORTO", "PROVINCIA", "COMUNE", "CIG"]]
+    tmp = f"{output}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    regioni = pc.unique(sorgente.to_table(columns=["REGIONE"]).column("REGIONE").combine_chunks().cast(pa.string()))
+    for regione in regioni.to_pylist():
+        filtro = ds.field("REGIONE").is_null() if regione is None else ds.field("REGIONE") == regione
+        tabella = sorgente.to_table(filter=filtro).sort_by(ordinamento)
+        # ogni regione è scritta nella propria cartella REGIONE=...
+        ds.write_dataset(
+            tabella,
+            tmp,
+            format="parquet",
+            partitioning=partizionamento,
+            basename_template="part-{i}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+            min_rows_per_group=righe_per_gruppo,
+            max_rows_per_group=righe_per_gruppo
+        )
+    shutil.rmtree(output, ignore_errors=True)
+    os.replace(tmp, output)
+    print(f"Dataset partizionato per {' e '.join(colonne_partizione)} scritto in {output}: {len(regioni)} regioni")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Costruisce incrementalmente il dataset CIG-CUP della App")
+    parser.add_argument("--anac", required=True, help="export ANAC, una riga per coppia CIG-CUP")
+    parser.add_argument("--opencup", required=True, help="export OpenCUP con la localizzazione dei CUP")
+    parser.add_argument("--openpnrr", required=True, help="export OpenPNRR con missione e componente dei CUP")
+    parser.add_argument("--output", default="data/cig_cup_final.parquet", help="cartella del dataset partizionato")
+    parser.add_argument("--bucket", type=int, default=32,
+                        help="numero di file in cui sono ripartiti i CIG (cambiandolo va ricostruito il dataset)")
+    parser.add_argument("--sep", default=",", help="separatore dei file CSV")
+    parser.add_argument("--righe-per-blocco", type=int, default=200_000, help="righe ANAC lette per blocco")
+    parser.add_argument("--partizionato", help="cartella in cui scrivere anche una copia del dataset partizionata per REGIONE")
+    parser.add_argument("--per-missione", action="store_true", help="partiziona la copia anche per MISSIONE")
+    parser.add_argument("--versione", help="pubblica il dataset aggiornato come versione mensile AAAA-MM nell'archivio")
+    parser.add_argument("--archivio", default=versioni.PATH_VERSIONI, help="cartella dell'archivio delle versioni")
+    args = parser.parse_args()
+    esegui(args.anac, args.opencup, args.openpnrr, args.output,
+           n_bucket=args.bucket, sep=args.sep, righe_per_blocco=args.righe_per_blocco)
+    if args.partizionato:
+        partiziona(args.output, args.partizionato, per_missione=args.per_missione, protette=(args.archivio,))
+    if args.versione:
+        print(f"Versione pubblicata in {versioni.pubblica_versione(args.output, args.versione, args.archivio)}")
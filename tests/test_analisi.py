@@ -0,0 +1,71 @@
+"""
+    Test dei conteggi del cubo di aggregazione (analisi.aggregati): CIG distinti per gruppo uguali a
+    groupby(...)["CIG"].nunique() sulle righe filtrate, su un dataset sintetico di bench.py con chiavi mancanti
+    e CIG collegati a più CUP e Comuni
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import analisi
+import bench
+
+CASI_FILTRI = dict(bench.CASI_FILTRI, **{
+    "urgenza_quote": {"flag_urgenza": True, "filtro_quota_giovanile": analisi.INFERIORE_30},
+    "province_esito": {"filtro_province": ["PROVINCIA 000", "PROVINCIA 001", "PROVINCIA 002"],
+                       "filtro_esito": [bench.ESITI[0]], "filtro_importo": ["BASSA", "MEDIA"]}
+})
+
+
+@pytest.fixture(scope="module")
+def path(tmp_path_factory)->str:
+    path = str(tmp_path_factory.mktemp("dati") / "cig.parquet")
+    bench.scrivi_dataset(bench.genera_dataset(5_000, seed=1), path)
+    return path
+
+def maschere_attese(data:pd.DataFrame, filtri:analisi.Filtri)->tuple:
+    """
+        Righe dei dati filtrati e dei dati dei grafici, calcolate direttamente sulle colonne
+    """
+    charts = np.ones(len(data), dtype=bool)
+    for campo, col in (("filtro_regioni", "REGIONE"), ("filtro_province", "PROVINCIA"), ("filtro_missioni", "MISSIONE"),
+                       ("filtro_motivo_urgenza", "MOTIVO_URGENZA"), ("filtro_esito", "ESITO"), ("filtro_importo", "CLASSE_IMPORTO")):
+        if getattr(filtri, campo):
+            charts &= data[col].isin(getattr(filtri, campo)).to_numpy()
+    if filtri.filtro_comuni:
+        charts &= (data.COMUNE == filtri.filtro_comuni).to_numpy()
+    filtered = charts.copy()
+    if filtri.flag_premiali:
+        filtered &= (data.FLAG_MISURE_PREMIALI == "S").to_numpy()
+    if filtri.flag_urgenza:
+        filtered &= (data.FLAG_URGENZA == 1).to_numpy()
+    for quota, col in ((filtri.filtro_quota_femminile, "QUOTA_FEMMINILE"), (filtri.filtro_quota_giovanile, "QUOTA_GIOVANILE")):
+        if quota != analisi.INCLUDI_TUTTI:
+            filtered &= ((data[col] == ">30%") == (quota == analisi.MAGGIORE_30)).to_numpy()
+    return filtered, charts
+
+def distinti(data:pd.DataFrame, by:list)->dict:
+    conteggi = data.groupby(by, observed=True)["CIG"].nunique()
+    return {chiave: n for chiave, n in conteggi.items() if n > 0}
+
+def test_dataset_di_prova(path):
+    data = analisi.fetch_data(path)
+    assert data[["REGIONE", "PROVINCIA", "COMUNE", "MOTIVO_URGENZA", "QUOTA_FEMMINILE"]].isna().any().all()
+    per_cig = data.groupby("CIG", observed=True)[["CUP", "COMUNE"]].nunique()
+    assert ((per_cig.CUP > 1) & (per_cig.COMUNE > 1)).any()
+
+@pytest.mark.parametrize("caso", list(CASI_FILTRI))
+def test_aggregati_uguali_a_nunique(path, caso):
+    data = analisi.fetch_data(path)
+    filtri = analisi.Filtri.da_dict(CASI_FILTRI[caso])
+    filtered, charts = maschere_attese(data, filtri)
+    risultato = analisi.aggregati(path, filtri)
+
+    assert risultato["province"]["CIG"].to_dict() == distinti(data[filtered], ["PROVINCIA"])
+    for nome in ("regioni", "regioni_missioni", "missioni_componenti"):
+        by = list(analisi.AGGREGATI[nome])
+        totale = distinti(data[charts], by)
+        for indicatore, (col, valore) in analisi.INDICATORI.items():
+            conteggi = risultato[nome].loc[indicatore]
+            assert conteggi["NUMERO_CIG"].to_dict() == totale
+            attesi = distinti(data[charts & (data[col] == valore).to_numpy()], by)
+            assert conteggi["CIG_FILTRATI"].to_dict() == {chiave: attesi.get(chiave, 0) for chiave in totale}
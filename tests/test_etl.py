@@ -0,0 +1,106 @@
+"""
+    Test dell'ETL sugli export di esempio in tests/fixtures: aggiornamento incrementale (etl.esegui), dove
+    l'export aggiornato modifica e rimuove CIG, toglie un collegamento CIG-CUP e cambia la localizzazione di alcuni CUP,
+    e copia partizionata (etl.partiziona)
+"""
+import os
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+import analisi
+import etl
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+N_BUCKET = 4
+RIGHE_PER_BLOCCO = 3
+
+
+def fixture(nome:str)->str:
+    return os.path.join(FIXTURES, nome)
+
+def esegui(anac:str, opencup:str, output:str, righe_per_blocco:int=RIGHE_PER_BLOCCO):
+    etl.esegui(anac, opencup, fixture("openpnrr.csv"), str(output),
+               n_bucket=N_BUCKET, righe_per_blocco=righe_per_blocco)
+
+def leggi(output)->pd.DataFrame:
+    """
+        Righe del dataset (file part-XX.parquet) in un ordine confrontabile
+    """
+    parti = sorted(nome for nome in os.listdir(output) if nome.startswith("part-"))
+    data = pd.concat([pq.read_table(os.path.join(output, nome)).to_pandas() for nome in parti], ignore_index=True)
+    return data.sort_values(list(data.columns), na_position="first").reset_index(drop=True)
+
+def file_bucket(output)->set:
+    return {nome for nome in os.listdir(output) if not nome.startswith("_")}
+
+def test_incrementale_uguale_a_ricostruzione(tmp_path):
+    incrementale, completo = tmp_path / "incrementale", tmp_path / "completo"
+    esegui(fixture("anac.csv"), fixture("opencup.csv"), incrementale)
+    esegui(fixture("anac_aggiornato.csv"), fixture("opencup_aggiornato.csv"), incrementale)
+    esegui(fixture("anac_aggiornato.csv"), fixture("opencup_aggiornato.csv"), completo)
+
+    pd.testing.assert_frame_equal(leggi(incrementale), leggi(completo))
+    assert file_bucket(incrementale) == file_bucket(completo)
+    for nome in ("cig", "cup"):
+        pd.testing.assert_series_equal(
+            etl.leggi_stato(str(incrementale), nome).sort_index(),
+            etl.leggi_stato(str(completo), nome).sort_index()
+        )
+
+    data = leggi(incrementale)
+    assert "9A00000005" not in set(data.CIG)
+    assert set(data.loc[data.CIG == "9A00000006", "COMUNE"]) == {"AVERSA"}
+    assert set(data.loc[data.CIG == "9A00000002", "CUP"]) == {"J10000000000002"}
+
+def test_risultato_indipendente_dai_blocchi(tmp_path):
+    # gli export ripetono in fondo una riga già presente, che finisce quindi in un altro blocco
+    for anac in ("anac.csv", "anac_aggiornato.csv"):
+        risultati = []
+        for righe_per_blocco in (1, RIGHE_PER_BLOCCO, 1000):
+            output = tmp_path / f"{anac}-{righe_per_blocco}"
+            esegui(fixture(anac), fixture("opencup.csv"), output, righe_per_blocco)
+            risultati.append(leggi(output))
+        assert not risultati[0].duplicated().any()
+        for data in risultati[1:]:
+            pd.testing.assert_frame_equal(data, risultati[0])
+
+def test_rieseguire_senza_modifiche_non_riscrive(tmp_path):
+    esegui(fixture("anac.csv"), fixture("opencup.csv"), tmp_path)
+    prima = {nome: os.path.getmtime(tmp_path / nome) for nome in file_bucket(tmp_path)}
+    esegui(fixture("anac.csv"), fixture("opencup.csv"), tmp_path)
+    assert {nome: os.path.getmtime(tmp_path / nome) for nome in file_bucket(tmp_path)} == prima
+
+def test_bucket_svuotato_viene_rimosso(tmp_path):
+    anac = pd.read_csv(fixture("anac.csv"), dtype=str).dropna(subset=["CIG"])
+    bucket = etl.bucket_cig(anac.CIG, N_BUCKET)
+    svuotato = bucket[0]
+    ridotto = tmp_path / "anac_ridotto.csv"
+    anac[bucket != svuotato].to_csv(ridotto, index=False)
+
+    output = tmp_path / "output"
+    esegui(fixture("anac.csv"), fixture("opencup.csv"), output)
+    assert f"part-{svuotato:02d}.parquet" in file_bucket(output)
+    esegui(str(ridotto), fixture("opencup.csv"), output)
+    assert f"part-{svuotato:02d}.parquet" not in file_bucket(output)
+
+    completo = tmp_path / "completo"
+    esegui(str(ridotto), fixture("opencup.csv"), completo)
+    pd.testing.assert_frame_equal(leggi(output), leggi(completo))
+    assert file_bucket(output) == file_bucket(completo)
+
+def test_partiziona_non_sovrascrive_input_e_archivio(tmp_path):
+    dati, archivio = tmp_path / "dati", tmp_path / "data" / "versioni"
+    esegui(fixture("anac.csv"), fixture("opencup.csv"), dati)
+    archivio.mkdir(parents=True)
+    prima = file_bucket(dati)
+    for output in (dati, tmp_path, dati / "partizionato", tmp_path / "data"):
+        with pytest.raises(ValueError):
+            etl.partiziona(str(dati), str(output), protette=(str(archivio),))
+    assert file_bucket(dati) == prima and archivio.is_dir()
+
+    # il CUP senza localizzazione in OpenCUP finisce nella partizione della regione nulla
+    etl.partiziona(str(dati), str(tmp_path / "partizionato"), protette=(str(archivio),))
+    partizionato = analisi.fetch_data(str(tmp_path / "partizionato"))
+    assert len(partizionato) == len(leggi(dati))
+    assert partizionato.REGIONE.dtype == "category"
+    assert partizionato.REGIONE.isna().sum() == leggi(dati).REGIONE.isna().sum() > 0
@@ -0,0 +1,176 @@
+"""
+    Archivio delle versioni mensili del dataset CIG-CUP, per confrontare i dati tra un aggiornamento e l'altro.
+
+    Ogni versione (es. 2024-05) è una cartella dell'archivio, scritta una sola volta e mai sovrascritta:
+    * dati.parquet: copia del dataset della versione
+    * riepilogo.parquet: CIG distinti per livello (totale, regione, missione, componente,
+      regione/missione/componente) e per indicatore di premialità
+    Confronti e andamenti si calcolano dai soli riepiloghi, senza rileggere le righe dei dati.
+
+    Uso:
+        python versioni.py pubblica --dati data/cig_cup_final.parquet --versione 2024-05
+        python versioni.py diff 2024-04 2024-05 --livello REGIONE
+"""
+import argparse
+import os
+import re
+import shutil
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import analisi
+
+PATH_VERSIONI = "data/versioni"
+FORMATO_VERSIONE = r"\d{4}-(0[1-9]|1[0-2])"
+
+# livelli del riepilogo e colonne dei gruppi; il totale ha un solo gruppo, identificato dalla colonna LIVELLO
+LIVELLI = {
+    "TOTALE": [],
+    "REGIONE": ["REGIONE"],
+    "MISSIONE": ["MISSIONE"],
+    "COMPONENTE": ["CODICE_MISSIONE", "COMPONENTE"],
+    "REGIONE_MISSIONE_COMPONENTE": ["REGIONE", "CODICE_MISSIONE", "COMPONENTE"]
+}
+DIMENSIONI = ["REGIONE", "MISSIONE", "CODICE_MISSIONE", "COMPONENTE"]
+# "totale" conta tutti i CIG del gruppo, gli altri solo quelli con l'indicatore
+INDICATORI = ["totale"] + list(analisi.INDICATORI)
+
+
+def riepiloga(data:pd.DataFrame)->pd.DataFrame:
+    """
+        Riepilogo di una versione: CIG distinti per ogni livello, gruppo e indicatore, in formato lungo
+    """
+    selezioni = {"totale": np.ones(len(data), dtype=bool)}
+    for nome, (col, valore) in analisi.INDICATORI.items():
+        selezioni[nome] = (data[col] == valore).to_numpy()
+    parti = []
+    for livello, by in LIVELLI.items():
+        for indicatore, selezione in selezioni.items():
+            righe = data.loc[selezione, by + ["CIG"]]
+            if by:
+                conteggi = righe.groupby(by, observed=True)["CIG"].nunique().reset_index()
+                conteggi[by] = conteggi[by].astype(object)
+            else:
+                conteggi = pd.DataFrame({"CIG": [righe["CIG"].nunique()]})
+            conteggi["LIVELLO"] = livello
+            conteggi["INDICATORE"] = indicatore
+            parti.append(conteggi)
+    riepilogo = pd.concat(parti, ignore_index=True).reindex(columns=["LIVELLO"] + DIMENSIONI + ["INDICATORE", "CIG"])
+    return riepilogo.astype({col: object for col in DIMENSIONI}).astype({"CIG": np.int64})
+
+def verifica_versione(versione:str)->str:
+    """
+        Versione nel formato AAAA-MM; altri valori sono rifiutati prima di comporre percorsi nell'archivio
+    """
+    if not re.fullmatch(FORMATO_VERSIONE, versione):
+        raise ValueError(f"Versione non valida: {versione} (formato atteso AAAA-MM)")
+    return versione
+
+def pubblica_versione(path_dati:str, versione:str, archivio:str=PATH_VERSIONI)->str:
+    """
+        Aggiunge all'archivio la versione indicata (AAAA-MM), con la copia del dataset e il suo riepilogo.
+        L'archivio è in sola aggiunta: una versione già pubblicata non viene sovrascritta
+    """
+    destinazione = os.path.join(archivio, verifica_versione(versione))
+    if os.path.exists(destinazione):
+        raise FileExistsError(f"La versione {versione} è già presente in {archivio}")
+    # la versione è scritta in una cartella temporanea e resa visibile solo quando è completa
+    tmp = os.path.join(archivio, f".{versione}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    copia = os.path.join(tmp, "dati.parquet")
+    if os.path.isdir(path_dati):
+        # senza i file di stato dell'ETL (_stato_*.parquet), che non fanno parte dei dati
+        shutil.copytree(path_dati, copia, ignore=shutil.ignore_patterns("_*", ".*"))
+    else:
+        shutil.copy2(path_dati, copia)
+    colonne = tuple(DIMENSIONI + ["CIG"] + [col for col, _ in analisi.INDICATORI.values()])
+    riepiloga(analisi.fetch_data(copia, colonne=colonne)).to_parquet(os.path.join(tmp, "riepilogo.parquet"), index=False)
+    os.replace(tmp, destinazione)
+    return destinazione
+
+def elenco_versioni(archivio:str=PATH_VERSIONI)->list:
+    """
+        Versioni pubblicate nell'archivio, dalla meno recente
+    """
+    if not os.path.isdir(archivio):
+        return []
+    return sorted(
+        nome for nome in os.listdir(archivio)
+        if re.fullmatch(FORMATO_VERSIONE, nome) and os.path.exists(os.path.join(archivio, nome, "riepilogo.parquet"))
+    )
+
+@lru_cache(maxsize=None)
+def leggi_riepilogo(archivio:str, versione:str)->pd.DataFrame:
+    """
+        Riepilogo di una versione; le versioni non cambiano dopo la pubblicazione, quindi si legge una sola volta
+    """
+    return pd.read_parquet(os.path.join(archivio, verifica_versione(versione), "riepilogo.parquet"))
+
+def conteggi(archivio:str, versione:str, livello:str)->pd.DataFrame:
+    """
+        CIG distinti di una versione per gruppo del livello (righe) e indicatore (colonne)
+    """
+    riepilogo = leggi_riepilogo(archivio, versione)
+    riepilogo = riepilogo[riepilogo.LIVELLO == livello]
+    return (
+        riepilogo.set_index((LIVELLI[livello] or ["LIVELLO"]) + ["INDICATORE"])["CIG"]
+        .unstack("INDICATORE", fill_value=0)
+        .reindex(columns=INDICATORI, fill_value=0)
+    )
+
+def quote(conteggi:pd.DataFrame)->pd.DataFrame:
+    """
+        Percentuale dei CIG di ogni gruppo che presentano ciascun indicatore
+    """
+    return conteggi.div(conteggi["totale"].where(conteggi["totale"] > 0), axis=0) * 100
+
+def diff_versioni(da:str, a:str, livello:str="REGIONE", archivio:str=PATH_VERSIONI)->pd.DataFrame:
+    """
+        Variazione tra due versioni, per gruppo del livello e indicatore: CIG distinti nelle due versioni (CIG_DA, CIG_A),
+        percentuale sui CIG del gruppo (QUOTA_DA, QUOTA_A) e differenze, con le quote in punti percentuali
+    """
+    for versione in (da, a):
+        verifica_versione(versione)
+    prima, dopo = conteggi(archivio, da, livello), conteggi(archivio, a, livello)
+    gruppi = prima.index.union(dopo.index)
+    prima, dopo = prima.reindex(gruppi, fill_value=0), dopo.reindex(gruppi, fill_value=0)
+    diff = pd.DataFrame({
+        "CIG_DA": prima.stack(),
+        "CIG_A": dopo.stack(),
+        "QUOTA_DA": quote(prima).stack(dropna=False),
+        "QUOTA_A": quote(dopo).stack(dropna=False)
+    })
+    diff["DIFFERENZA"] = diff["CIG_A"] - diff["CIG_DA"]
+    diff["DIFFERENZA_QUOTA"] = diff["QUOTA_A"] - diff["QUOTA_DA"]
+    return diff[["CIG_DA", "CIG_A", "DIFFERENZA", "QUOTA_DA", "QUOTA_A", "DIFFERENZA_QUOTA"]]
+
+def andamento(indicatore:str, livello:str="TOTALE", archivio:str=PATH_VERSIONI)->pd.DataFrame:
+    """
+        Percentuale dei CIG con l'indicatore per versione (righe) e gruppo del livello (colonne)
+    """
+    serie = {versione: quote(conteggi(archivio, versione, livello))[indicatore] for versione in elenco_versioni(archivio)}
+    andamento = pd.DataFrame(serie).T
+    if isinstance(andamento.columns, pd.MultiIndex):
+        andamento.columns = [" - ".join(map(str, gruppo)) for gruppo in andamento.columns]
+    andamento.index.name = "VERSIONE"
+    return andamento
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archivio delle versioni mensili del dataset CIG-CUP")
+    parser.add_argument("--archivio", default=PATH_VERSIONI, help="cartella dell'archivio delle versioni")
+    comandi = parser.add_subparsers(dest="comando", required=True)
+    pubblica = comandi.add_parser("pubblica", help="aggiunge una versione all'archivio")
+    pubblica.add_argument("--dati", default=analisi.PATH_DATI, help="dataset da archiviare")
+    pubblica.add_argument("--versione", required=True, help="versione nel formato AAAA-MM")
+    confronta = comandi.add_parser("diff", help="variazioni tra due versioni")
+    confronta.add_argument("da")
+    confronta.add_argument("a")
+    confronta.add_argument("--livello", default="REGIONE", choices=list(LIVELLI))
+    args = parser.parse_args()
+    if args.comando == "pubblica":
+        print(f"Versione pubblicata in {pubblica_versione(args.dati, args.versione, args.archivio)}")
+    else:
+        with pd.option_context("display.max_rows", None, "display.width", 200):
+            print(diff_versioni(args.da, args.a, args.livello, args.archivio))